@@ -0,0 +1,56 @@
+import numpy as np
+
+WHITE = 255
+BLACK = 0
+
+
+def _to_rgb(black):
+    image = np.full(black.shape + (3,), WHITE, dtype=np.uint8)
+    image[black] = BLACK
+    return image
+
+
+def solid(size, seed=0):
+    return _to_rgb(np.ones((size, size), dtype=bool))
+
+
+def checkerboard(size, seed=0, cell=8):
+    index = np.arange(size) // cell
+    return _to_rgb((index[:, None] + index[None, :]) % 2 == 0)
+
+
+def noise(size, seed=0):
+    return _to_rgb(np.random.RandomState(seed).rand(size, size) > 0.5)
+
+
+def gradient(size, seed=0):
+    # Smooth shading dithered with a Bayer matrix, like a photo prepared for a binary printer
+    y, x = np.mgrid[0:size, 0:size] / float(size)
+    shade = 0.5 + 0.25 * np.sin(6.0 * x) * np.cos(4.0 * y) + 0.25 * (x - y)
+    bayer = np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]) / 16.0
+    threshold = np.tile(bayer, (size // 4 + 1, size // 4 + 1))[:size, :size]
+    return _to_rgb(shade < threshold)
+
+
+def traces(size, seed=0, count=None):
+    # Sparse thin lines covering a few percent of the layer, like circuit traces or outlines
+    random = np.random.RandomState(seed)
+    black = np.zeros((size, size), dtype=bool)
+    width = max(1, size // 256)
+    for _ in range(count or max(4, size // 32)):
+        start = random.randint(0, size - width)
+        first, last = sorted(random.randint(0, size, 2))
+        if random.rand() < 0.5:
+            black[start:start + width, first:last] = True
+        else:
+            black[first:last, start:start + width] = True
+    return _to_rgb(black)
+
+
+PATTERNS = {
+    'solid': solid,
+    'checkerboard': checkerboard,
+    'noise': noise,
+    'gradient': gradient,
+    'traces': traces,
+}
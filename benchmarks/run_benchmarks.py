@@ -0,0 +1,233 @@
+'''Times the rasterizer on synthetic layers and compares the results against a baseline.
+
+eg. python benchmarks/run_benchmarks.py -s 256 1024 -o current.json -c baseline.json
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, SRC)
+
+from peachyraster.raster import Raster, ImageRaster
+from peachyraster.gcode import format_table
+from images import PATTERNS
+
+# Rates where a lower value is a regression, bytes per second only while the output size is unchanged
+RATES = ['pixels_per_second', 'lines_per_second', 'bytes_per_second', 'compression_ratio']
+# Output sinks timed against plain gcode text, bytes per second is the size on disk
+OUTPUTS = [('gcode', 'gzip'), ('gcode', 'lzma'), ('moves', 'none'), ('moves', 'gzip')]
+# Cold starts of a fresh interpreter, the CLI's --help and importing the rasterizer itself
+STARTUPS = [('help', ['-m', 'peachyraster.peachyraster', '--help']), ('import', ['-c', 'import peachyraster.raster'])]
+
+
+def time_best(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def traced_peak(function):
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def image_raster_case(image, args, optimize_travel=False):
+    def run():
+        raster = ImageRaster(args.kerf, args.border, back_and_forth=args.alternate_raster, optimize_travel=optimize_travel)
+        lines = 0
+        size = 0
+        for chunk in raster.generate(image):
+            lines += chunk.count('\n')
+            size += len(chunk)
+        return lines, size
+    return run
+
+
+def pipeline_case(image, args, folder):
+    image_file = os.path.join(folder, 'layer.png')
+    output_file = os.path.join(folder, 'layer.gcode')
+    Image.fromarray(image).save(image_file)
+
+    def run():
+        Raster(args.kerf, args.border, output_file, back_and_forth=args.alternate_raster).process_file(image_file)
+        with open(output_file) as gcode:
+            lines = sum(1 for _ in gcode)
+        return lines, os.path.getsize(output_file)
+    return run
+
+
+def output_case(image, args, folder, output_format, compression):
+    image_file = os.path.join(folder, 'layer.png')
+    output_file = os.path.join(folder, 'layer.out')
+    Image.fromarray(image).save(image_file)
+
+    def run():
+        Raster(args.kerf, args.border, output_file, back_and_forth=args.alternate_raster, output_format=output_format, compression=compression).process_file(image_file)
+        return 0, os.path.getsize(output_file)
+    return run
+
+
+def format_case(count, batched):
+    random = np.random.RandomState(0)
+    columns = [random.rand(count) * 200 - 100 for _ in range(4)] + [np.cumsum(random.randint(1, 50, count)).astype(np.float64)]
+    literals = ["G0 F1 X", " Y", " E0.00\nG1 F1 X", " Y", " E", "\n"]
+
+    def run():
+        if batched:
+            text = format_table(literals, columns)
+        else:
+            template = "G0 F1 X{:.2f} Y{:.2f} E0.00\nG1 F1 X{:.2f} Y{:.2f} E{:.2f}\n"
+            text = ''.join([template.format(*move) for move in zip(*[column.tolist() for column in columns])])
+        return count * 2, len(text)
+    return run
+
+
+def startup_case(args):
+    environment = dict(os.environ, PYTHONPATH=SRC)
+
+    def run():
+        output = subprocess.check_output([sys.executable] + args, env=environment)
+        return output.count(b'\n'), len(output)
+    return run
+
+
+def measure(name, run, pixels, repeats, traced=True):
+    seconds, (lines, size) = time_best(run, repeats)
+    seconds = max(seconds, 1e-9)
+    return {
+        'name': name,
+        'seconds': seconds,
+        'pixels': pixels,
+        'lines': lines,
+        'bytes': size,
+        'pixels_per_second': pixels / seconds,
+        'lines_per_second': lines / seconds,
+        'bytes_per_second': size / seconds,
+        'peak_layer_bytes': traced_peak(run) if traced else None,
+    }
+
+
+def run_benchmarks(args):
+    results = []
+    folder = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            for pattern in args.patterns:
+                image = PATTERNS[pattern](size)
+                name = '{}-{}'.format(pattern, size)
+                print("Benchmarking: {}".format(name))
+                results.append(measure(name + '-image_raster', image_raster_case(image, args), image.shape[0] * image.shape[1], args.repeats))
+                results.append(measure(name + '-optimize_travel', image_raster_case(image, args, True), image.shape[0] * image.shape[1], args.repeats))
+                results.append(measure(name + '-pipeline', pipeline_case(image, args, folder), image.shape[0] * image.shape[1], args.repeats))
+                text_bytes = results[-1]['bytes']
+                for output_format, compression in OUTPUTS:
+                    result = measure('{}-{}-{}'.format(name, output_format, compression), output_case(image, args, folder, output_format, compression), image.shape[0] * image.shape[1], args.repeats)
+                    result['compression_ratio'] = float(text_bytes) / result['bytes'] if result['bytes'] else 0.0
+                    results.append(result)
+        for count in args.format_moves:
+            print("Benchmarking: format-{}".format(count))
+            results.append(measure('format-{}-batched'.format(count), format_case(count, True), 0, args.repeats))
+            results.append(measure('format-{}-str_format'.format(count), format_case(count, False), 0, args.repeats))
+        for name, startup_args in STARTUPS:
+            print("Benchmarking: startup-{}".format(name))
+            # Startups run in a child interpreter that tracemalloc cannot see into
+            results.append(measure('startup-{}'.format(name), startup_case(startup_args), 0, args.repeats, traced=False))
+    finally:
+        shutil.rmtree(folder)
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    baseline_results = dict((result['name'], result) for result in baseline['results'])
+    regressions = []
+    print("{:36} {:>20} {:>10}".format('Benchmark', 'Rate', 'Change'))
+    for result in current['results']:
+        previous = baseline_results.get(result['name'])
+        if previous is None:
+            continue
+        for rate in RATES:
+            if not previous.get(rate) or rate not in result:
+                continue
+            if rate == 'bytes_per_second' and result['bytes'] != previous['bytes']:
+                continue
+            change = result[rate] / previous[rate] - 1.0
+            flag = ''
+            if change < -tolerance:
+                flag = ' REGRESSION'
+                regressions.append((result['name'], rate))
+            print("{:36} {:>20} {:>+9.1%}{}".format(result['name'], rate, change, flag))
+    return regressions
+
+
+def report(current):
+    print("{:36} {:>9} {:>12} {:>12} {:>12} {:>12} {:>8}".format('Benchmark', 'Seconds', 'Mpixels/s', 'Klines/s', 'MB/s', 'Peak MB', 'Ratio'))
+    for result in current['results']:
+        ratio = "{:.1f}x".format(result['compression_ratio']) if 'compression_ratio' in result else ''
+        peak = "{:.2f}".format(result['peak_layer_bytes'] / 1e6) if result['peak_layer_bytes'] is not None else ''
+        print("{:36} {:>9.3f} {:>12.2f} {:>12.2f} {:>12.2f} {:>12} {:>8}".format(
+            result['name'],
+            result['seconds'],
+            result['pixels_per_second'] / 1e6,
+            result['lines_per_second'] / 1e3,
+            result['bytes_per_second'] / 1e6,
+            peak,
+            ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmarks the rasterizer on synthetic layers")
+    parser.add_argument('-s', '--sizes', default=[256, 1024, 2048], type=int, nargs='+', help="Square layer sizes in pixels. eg. -s 256 1024")
+    parser.add_argument('-p', '--patterns', default=sorted(PATTERNS), choices=sorted(PATTERNS), nargs='+', help="Layer patterns to generate. eg. -p noise traces")
+    parser.add_argument('-f', '--format_moves', default=[100000], type=int, nargs='*', help="Moves formatted by the gcode formatter benchmark. eg. -f 10000 100000")
+    parser.add_argument('-n', '--repeats', default=3, type=int, help="Runs per benchmark, the fastest is kept. eg. -n5")
+    parser.add_argument('-k', '--kerf', default=0.1, type=float, help="The width(kerf) of the cutter. eg. -k0.1")
+    parser.add_argument('-b', '--border', default=1, type=int, help="Adds a border of kerfs widths. eg. -b2")
+    parser.add_argument('-r', '--alternate_raster', action='store_true', help="Alternate rastering style eg. -r")
+    parser.add_argument('-o', '--output', help="Writes the results as JSON. eg. -o results.json")
+    parser.add_argument('-c', '--compare', help="Baseline JSON results to compare against. eg. -c baseline.json")
+    parser.add_argument('-t', '--tolerance', default=0.1, type=float, help="Allowed slow down before a rate counts as a regression. eg. -t0.1")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args)
+    report(current)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(current, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("\n{} regressions".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -83,10 +83,9 @@ cd ..
 
 echo "------------------------------------"
 echo "Running Tests"
-echo `python2.7 --version`
+echo `python --version`
 echo "------------------------------------"
 
-pip install mock
 python test/test-all.py
 
 if [ $? != 0 ]; then
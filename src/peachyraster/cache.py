@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import os
+import os.path
+import struct
+import time
+from .runs import LayerRuns
+
+CACHE_VERSION = 4
+CACHE_SUFFIX = '.runs'
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class RunCache(object):
+    '''On disk cache of layer runs keyed by image content and the settings that change the runs.
+
+    Kerf, direction and extrusion are applied when runs are emitted, so they are not part of the key.
+    Entries are evicted least recently used first once the cache grows past max_bytes.'''
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, file_name, *settings):
+        digest = hashlib.sha1()
+        with open(file_name, 'rb') as image_file:
+            for block in iter(lambda: image_file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        digest.update(repr((CACHE_VERSION,) + settings).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            layer = LayerRuns.load(path)
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return layer
+
+    def put(self, key, layer):
+        path = self._path(key)
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        layer.save(temporary)
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            os.remove(temporary)
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(self.directory, name)
+                status = os.stat(path)
+                entries.append((status.st_mtime, status.st_size, path))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info("Evicting cached runs {0}".format(path))
+            os.remove(path)
+            total -= size
+            self.evicted += 1
+
+    def report(self):
+        return "Cache: {} hits, {} misses, {} evicted".format(self.hits, self.misses, self.evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
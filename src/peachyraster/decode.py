@@ -0,0 +1,274 @@
+import logging
+import os.path
+import numpy as np
+from PIL import Image
+
+# Channels per pixel for the uncompressed layouts that can be memory mapped, BGR is stored reversed
+RAW_CHANNELS = {'L': 1, 'RGB': 3, 'RGBA': 4, 'RGBX': 4, 'BGR': 3}
+# Millimetres per unit of ImageJ slice spacing
+UNIT_SCALES = {'mm': 1.0, 'cm': 10.0, 'micron': 0.001, 'um': 0.001, u'\u00b5m': 0.001}
+
+
+class PackedMask(object):
+    '''A black mask stored eight pixels to a byte, unpacked a band of rows, or of columns, at a time when sliced.'''
+
+    def __init__(self, mask):
+        self.shape = mask.shape
+        self.packed = np.packbits(mask, axis=1)
+
+    def __getitem__(self, rows):
+        return np.unpackbits(self.packed[rows], axis=1, count=self.shape[1]).astype(bool)
+
+    def columns(self, columns):
+        first, last, _ = columns.indices(self.shape[1])
+        last = max(first, last)
+        packed = self.packed[:, first // 8:-(-last // 8)]
+        return np.unpackbits(packed, axis=1)[:, first % 8:first % 8 + last - first].astype(bool)
+
+
+def load_mask(file_name, threshold=0, packed=False):
+    '''Reads an image as a mask that is True where the pixel luminance is at or below threshold.
+
+    A threshold of 0 only matches exact black, and transparent pixels are laid over white. With a
+    threshold of None the luminance itself is returned, for rastering in gray levels.'''
+    require_file(file_name)
+    if file_name.lower().endswith('.npy'):
+        mask = pixels_to_mask(np.load(file_name), threshold)
+    else:
+        with Image.open(file_name) as image:
+            mask = image_to_mask(image, threshold)
+    return PackedMask(mask) if packed and mask.dtype == bool else mask
+
+
+class StripMask(object):
+    '''A black mask read a band of rows at a time from pixels that are memory mapped or already decoded.
+
+    Pixels may be a bool mask, luminance or (red, green, blue, ...) values and are thresholded
+    like load_mask as each band is sliced, so only one band of mask is ever held.'''
+
+    def __init__(self, pixels, threshold=0):
+        self.pixels = pixels
+        self.threshold = threshold
+        self.shape = pixels.shape[:2]
+
+    def __getitem__(self, rows):
+        return pixels_to_mask(np.asarray(self.pixels[rows]), self.threshold)
+
+    def columns(self, columns):
+        '''Returns every row of a band of columns, for rastering column by column in bounded memory.'''
+        return pixels_to_mask(np.asarray(self.pixels[:, columns]), self.threshold)
+
+
+class _RawTiles(object):
+    def __init__(self, tiles, shape):
+        self.tiles = tiles
+        self.shape = shape
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        first, last, _ = rows.indices(self.shape[0])
+        parts = [pixels[max(first - top, 0):max(last - top, 0), columns] for (top, pixels) in self.tiles if top < last and top + len(pixels) > first]
+        return np.concatenate(parts) if len(parts) != 1 else parts[0]
+
+
+def open_strips(file_name, threshold=0):
+    '''Opens an image for band by band reading.
+
+    .npy files and uncompressed images (TIFF, PPM/PGM, BMP) are memory mapped, so only the rows
+    being rastered are read. Other formats have to be decoded whole, but are kept as one byte of
+    luminance per pixel.'''
+    require_file(file_name)
+    if file_name.lower().endswith('.npy'):
+        return StripMask(np.load(file_name, mmap_mode='r'), threshold)
+    with Image.open(file_name) as image:
+        pixels = _map_raw_tiles(image, file_name)
+        if pixels is None:
+            logging.info("{0} can not be memory mapped, decoding it whole".format(file_name))
+            pixels = image_to_mask(image, threshold)
+    return StripMask(pixels, threshold)
+
+
+class Volume(object):
+    '''The slices of a (Z, Y, X) .npy volume or a multi-page TIFF, each read like open_strips.
+
+    The file is opened once and uncompressed slices are memory mapped from it; compressed TIFF
+    pages are decoded when they are used, from an image kept open until close. spacing is the
+    distance between slices in mm from ImageJ TIFF metadata, or None when the volume does not give one.'''
+
+    def __init__(self, file_name, threshold=0):
+        require_file(file_name)
+        self.file_name = file_name
+        self.threshold = threshold
+        self.spacing = None
+        self.pages = None
+        self._data = None
+        self._image = None
+        if file_name.lower().endswith('.npy'):
+            self.shape = np.load(file_name, mmap_mode='r').shape[:3]
+            return
+        with Image.open(file_name) as image:
+            self.spacing = _imagej_spacing(image)
+            self.pages = []
+            for page in range(getattr(image, 'n_frames', 1)):
+                image.seek(page)
+                self.pages.append(_tile_table(image))
+            self.shape = (len(self.pages), image.size[1], image.size[0])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if self.pages is None:
+            return StripMask(self._mapped()[index], self.threshold)
+        table = self.pages[index]
+        if table is not None:
+            return StripMask(_table_pixels(self._mapped(), table), self.threshold)
+        image = self._opened()
+        image.seek(index)
+        return StripMask(image_to_mask(image, self.threshold), self.threshold)
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    def __getstate__(self):
+        # Mappings and images are opened again in each process that reads the volume
+        state = self.__dict__.copy()
+        state['_data'] = None
+        state['_image'] = None
+        return state
+
+    def _opened(self):
+        # Pillow reaches a page by walking the pages before it, so one image is kept open to walk them only once
+        if self._image is None:
+            self._image = Image.open(self.file_name)
+        return self._image
+
+    def _mapped(self):
+        if self._data is None:
+            if self.pages is None:
+                self._data = np.load(self.file_name, mmap_mode='r')
+            else:
+                self._data = np.memmap(self.file_name, dtype=np.uint8, mode='r')
+        return self._data
+
+
+def _imagej_spacing(image):
+    description = getattr(image, 'tag_v2', {}).get(270)
+    if not isinstance(description, str) or not description.startswith('ImageJ='):
+        return None
+    fields = dict(line.split('=', 1) for line in description.splitlines() if '=' in line)
+    scale = UNIT_SCALES.get(fields.get('unit', 'mm'))
+    if 'spacing' not in fields or scale is None:
+        return None
+    return float(fields['spacing']) * scale
+
+
+def pixels_to_mask(pixels, threshold=0):
+    if pixels.dtype == bool:
+        return pixels
+    if threshold is None:
+        return pixels_to_luminance(pixels)
+    if threshold == 0 and pixels.ndim == 3:
+        # Near black colours also have a luminance of 0, so only exact black is matched, as the reference does
+        colour, alpha = _split_alpha(pixels)
+        black = ~np.any(colour, axis=2)
+        return black if alpha is None else black & (alpha == 255)
+    return pixels_to_luminance(pixels) <= threshold
+
+
+def pixels_to_luminance(pixels):
+    '''Returns one byte of luminance per pixel for (gray or red, green, blue, [alpha]) pixels, with any alpha over white.'''
+    if pixels.ndim != 3:
+        return pixels
+    colour, alpha = _split_alpha(pixels)
+    colour = colour.astype(np.uint32)
+    if colour.shape[2] == 1:
+        luminance = colour[..., 0]
+    else:
+        # Pillow's integer RGB to L conversion, so mapped and decoded images threshold alike
+        luminance = (colour[..., 0] * 19595 + colour[..., 1] * 38470 + colour[..., 2] * 7471 + 0x8000) >> 16
+    if alpha is not None:
+        alpha = alpha.astype(np.uint32)
+        luminance = (luminance * alpha + 255 * (255 - alpha) + 127) // 255
+    return luminance.astype(np.uint8)
+
+
+def _split_alpha(pixels):
+    # Gray and alpha or red, green, blue and alpha pixels carry alpha last
+    if pixels.shape[2] in (2, 4):
+        return pixels[..., :-1], pixels[..., -1]
+    return pixels, None
+
+
+def _map_raw_tiles(image, file_name):
+    table = _tile_table(image)
+    if table is None:
+        return None
+    return _table_pixels(np.memmap(file_name, dtype=np.uint8, mode='r'), table)
+
+
+def _tile_table(image):
+    '''Describes where the uncompressed rows of the current frame are in the file, or returns None if they can not be mapped.'''
+    width, height = image.size
+    tiles = []
+    for tile in image.tile:
+        codec, extents, offset, args = tuple(tile)
+        if codec != 'raw':
+            return None
+        rawmode, stride, orientation = args if isinstance(args, tuple) else (args, 0, 1)
+        channels = RAW_CHANNELS.get(rawmode)
+        if channels is None or image.mode not in RAW_CHANNELS or extents[0] != 0 or extents[2] != width:
+            return None
+        tiles.append((extents[1], extents[3] - extents[1], offset, stride or width * channels, channels, orientation, rawmode))
+    if not tiles:
+        return None
+    return (height, width), sorted(tiles)
+
+
+def _table_pixels(data, table):
+    (height, width), tiles = table
+    mapped = []
+    for (top, rows, offset, stride, channels, orientation, rawmode) in tiles:
+        pixels = data[offset:offset + rows * stride].reshape(rows, stride)[:, :width * channels].reshape(rows, width, channels)
+        if orientation < 0:
+            pixels = pixels[::-1]
+        if rawmode == 'BGR':
+            pixels = pixels[:, :, ::-1]
+        if rawmode == 'RGBX':
+            pixels = pixels[:, :, :3]
+        mapped.append((top, pixels[:, :, 0] if channels == 1 else pixels))
+    return _RawTiles(mapped, (height, width))
+
+
+def require_file(file_name):
+    if not os.path.isfile(file_name):
+        logging.error("File {0} could not be found.".format(file_name))
+        raise IOError("File Not Found")
+
+
+def _exact_black(image):
+    '''Matches exact black in palette or colour images one band at a time rather than holding every band of every pixel.'''
+    if image.mode == 'P':
+        palette = image.getpalette() or []
+        black = [index for index in range(len(palette) // 3) if not any(palette[index * 3:index * 3 + 3])]
+        return np.isin(np.asarray(image), black)
+    if image.mode not in ('RGB', 'RGBX'):
+        image = image.convert('RGB')
+    colour = np.array(image.getchannel(0))
+    for band in (1, 2):
+        np.bitwise_or(colour, np.asarray(image.getchannel(band)), out=colour)
+    return colour == 0
+
+
+def image_to_mask(image, threshold=0):
+    if image.mode == '1' and threshold is not None:
+        return ~np.asarray(image)
+    if 'A' in image.getbands() or 'transparency' in image.info:
+        pixels = np.asarray(image.convert('RGBA'))
+    elif threshold == 0 and (image.mode == 'P' or len(image.getbands()) >= 3):
+        return _exact_black(image)
+    else:
+        pixels = np.asarray(image.convert('L'))
+    return pixels_to_mask(pixels, threshold)
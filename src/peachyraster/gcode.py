@@ -0,0 +1,77 @@
+import numpy as np
+
+PAD = 0
+# Scaled values this close to a rounding tie are formatted by Python so the result matches "{:.2f}" exactly
+TIE_MARGIN = 1e-6
+TIE_RELATIVE_MARGIN = 1e-14
+
+
+def format_table(literals, columns):
+    '''Formats rows of literals[0] column[0] literals[1] column[1] ... literals[-1] with each value as "{:.2f}".'''
+    return table_to_text(format_rows(literals, columns))
+
+
+def format_rows(literals, columns):
+    '''Returns one byte row per line, with unused bytes set to PAD so rows of different widths can be mixed.'''
+    count = len(columns[0]) if columns else 0
+    parts = [_literal(literals[0], count)]
+    for literal, column in zip(literals[1:], columns):
+        parts.append(_fixed_point(np.asarray(column, dtype=np.float64)))
+        parts.append(_literal(literal, count))
+    return np.hstack(parts)
+
+
+def choose_rows(condition, when_true, when_false):
+    width = max(when_true.shape[1], when_false.shape[1])
+    return np.where(np.asarray(condition)[:, None], _pad(when_true, width), _pad(when_false, width))
+
+
+def table_to_text(rows):
+    data = rows.ravel()
+    return data[data != PAD].tobytes().decode('ascii')
+
+
+def _literal(text, count):
+    data = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    return np.broadcast_to(data, (count, len(data)))
+
+
+def _pad(rows, width):
+    if rows.shape[1] == width:
+        return rows
+    padded = np.full((rows.shape[0], width), PAD, dtype=np.uint8)
+    padded[:, :rows.shape[1]] = rows
+    return padded
+
+
+def _fixed_point(values):
+    negative = np.signbit(values)
+    scaled = np.abs(values) * 100.0
+    hundredths = np.rint(scaled)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < np.maximum(TIE_MARGIN, scaled * TIE_RELATIVE_MARGIN)
+    hundredths = hundredths.astype(np.int64)
+    for index in np.nonzero(near_tie)[0].tolist():
+        hundredths[index] = int("{:.2f}".format(abs(values[index])).replace('.', ''))
+
+    whole = hundredths // 100
+    fraction = hundredths % 100
+    digits = 1
+    largest = int(whole.max()) if len(whole) else 0
+    while largest >= 10 ** digits:
+        digits += 1
+    width = digits + 4
+
+    field = np.full((len(values), width), PAD, dtype=np.uint8)
+    field[:, -1] = ord('0') + fraction % 10
+    field[:, -2] = ord('0') + fraction // 10
+    field[:, -3] = ord('.')
+    used = np.ones(len(values), dtype=np.intp)
+    remaining = whole
+    for digit in range(digits):
+        present = (remaining > 0) | (digit == 0)
+        field[:, -4 - digit] = np.where(present, ord('0') + remaining % 10, PAD)
+        used += present & (digit > 0)
+        remaining = remaining // 10
+    rows = np.nonzero(negative)[0]
+    field[rows, width - 4 - used[rows]] = ord('-')
+    return field
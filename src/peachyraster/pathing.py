@@ -0,0 +1,138 @@
+import bisect
+import numpy as np
+
+TWO_OPT_WINDOW = 32
+# 2-opt moves tried per run; the shortest reversals, tried first, save the most travel
+DEFAULT_TWO_OPT_BUDGET = 4
+
+
+def plan_path(rows, starts, ends, budget=DEFAULT_TWO_OPT_BUDGET):
+    '''Orders a layer's runs to shorten laser-off travel.
+
+    Runs may be cut in either direction. A greedy nearest endpoint tour is built first and then
+    improved with 2-opt moves over a sliding window until a pass finds no better move or budget moves
+    per run have been tried. Returns the run order and whether each run in that order is cut left to right.'''
+    order, forward = _greedy_path(rows.tolist(), starts.tolist(), (ends - 1).tolist())
+    order, forward = np.array(order, dtype=np.intp), np.array(forward, dtype=bool)
+    if budget > 0:
+        order, forward = _two_opt(rows, starts, ends - 1, order, forward, budget * len(order))
+    return order, forward
+
+
+def path_travel(rows, starts, ends, order, forward):
+    '''Total distance, in pixels, travelled between the runs when cut in the given order and directions.'''
+    if len(order) < 2:
+        return 0.0
+    rows, starts, lasts, forward = rows[order].astype(np.int64), starts[order].astype(np.int64), ends[order].astype(np.int64) - 1, np.asarray(forward)
+    entry = np.where(forward, starts, lasts)
+    exit = np.where(forward, lasts, starts)
+    dx = (entry[1:] - exit[:-1]).astype(np.float64)
+    dy = (rows[1:] - rows[:-1]).astype(np.float64)
+    return float(np.sum(np.hypot(dx, dy)))
+
+
+def merge_strokes(rows, starts, ends, width):
+    '''Chains runs with the same start and end in consecutive rows into serpentine strokes.
+
+    Returns the run order, whether each run in that order is cut left to right, and whether it
+    begins a new stroke. Strokes are ordered by their first run and alternate direction row by row.'''
+    span = np.int64(width + 1)
+    keys = (rows.astype(np.int64) * span + starts) * span + ends
+    # Runs are in row-major order so keys are sorted and the same run one row up can be found by search
+    previous = keys - span * span
+    position = np.minimum(np.searchsorted(keys, previous), max(len(keys) - 1, 0))
+    continues = keys[position] == previous if len(keys) else np.zeros(0, dtype=bool)
+    first = np.where(continues, position, np.arange(len(keys)))
+    while True:
+        jumped = first[first]
+        if np.array_equal(jumped, first):
+            break
+        first = jumped
+    order = np.lexsort((rows, first))
+    forward = (rows[order] - rows[first[order]]) % 2 == 0
+    return order, forward, ~continues[order]
+
+
+def _greedy_path(rows, firsts, lasts):
+    remaining = {}
+    for index, row in enumerate(rows):
+        remaining.setdefault(row, []).append(index)
+    remaining_firsts = dict((row, [firsts[index] for index in indexes]) for row, indexes in remaining.items())
+    active_rows = sorted(remaining)
+
+    order = []
+    forward = []
+    x, y = (firsts[0], rows[0]) if rows else (0, 0)
+    for _ in range(len(rows)):
+        best = None
+        best_distance = 0
+        above = bisect.bisect_left(active_rows, y)
+        below = above - 1
+        count = len(active_rows)
+        while below >= 0 or above < count:
+            if above >= count or (below >= 0 and y - active_rows[below] <= active_rows[above] - y):
+                row = active_rows[below]
+                below -= 1
+            else:
+                row = active_rows[above]
+                above += 1
+            row_distance = (row - y) ** 2
+            if best is not None and row_distance >= best_distance:
+                break
+            indexes = remaining[row]
+            position = bisect.bisect_right(remaining_firsts[row], x)
+            for candidate in (position - 1, position):
+                if 0 <= candidate < len(indexes):
+                    index = indexes[candidate]
+                    distance = (firsts[index] - x) ** 2 + row_distance
+                    if best is None or distance < best_distance:
+                        best, best_distance = (row, candidate, True), distance
+                    distance = (lasts[index] - x) ** 2 + row_distance
+                    if distance < best_distance:
+                        best, best_distance = (row, candidate, False), distance
+
+        row, candidate, is_forward = best
+        indexes = remaining[row]
+        index = indexes.pop(candidate)
+        remaining_firsts[row].pop(candidate)
+        if not indexes:
+            active_rows.pop(bisect.bisect_left(active_rows, row))
+        order.append(index)
+        forward.append(is_forward)
+        x, y = (lasts[index] if is_forward else firsts[index]), row
+    return order, forward
+
+
+def _two_opt(rows, firsts, lasts, order, forward, budget):
+    rows, firsts, lasts = rows[order].astype(np.float64), firsts[order].astype(np.float64), lasts[order].astype(np.float64)
+    entry = np.where(forward, firsts, lasts)
+    exit = np.where(forward, lasts, firsts)
+    count = len(order)
+    improved = True
+    while improved and budget > 0:
+        improved = False
+        for length in range(1, min(TWO_OPT_WINDOW, count - 1) + 1):
+            # Reversals of the same length starting length + 1 apart share no travel so are tried together
+            for phase in range(1, length + 2):
+                first = np.arange(phase, count - length + 1, length + 1)
+                budget -= len(first)
+                last = first + length - 1
+                # Reversing first..last flips each run, so only the travel at the two ends changes
+                before = np.hypot(entry[first] - exit[first - 1], rows[first] - rows[first - 1])
+                after = np.hypot(exit[last] - exit[first - 1], rows[last] - rows[first - 1])
+                following = np.minimum(last + 1, count - 1)
+                ends_tour = last + 1 == count
+                before += np.where(ends_tour, 0, np.hypot(entry[following] - exit[last], rows[following] - rows[last]))
+                after += np.where(ends_tour, 0, np.hypot(entry[following] - entry[first], rows[following] - rows[first]))
+                first = first[after < before - 1e-9]
+                if len(first):
+                    positions = first[:, None] + np.arange(length)
+                    reversed_positions = positions[:, ::-1]
+                    order[positions] = order[reversed_positions]
+                    forward[positions] = ~forward[reversed_positions]
+                    rows[positions] = rows[reversed_positions]
+                    entry[positions], exit[positions] = exit[reversed_positions], entry[reversed_positions]
+                    improved = True
+            if budget <= 0:
+                break
+    return order, forward
@@ -1,4 +1,5 @@
-from raster import Raster
+import os.path
+import sys
 import logging
 import argparse
 
@@ -10,31 +11,90 @@ class Run(object):
         parser.add_argument('-b', '--border',  default=[1], type=int, nargs=1, help="Adds a border of kerfs widths. eg. -b2")
         parser.add_argument('-d', '--directory',   nargs=1, help="Processes an entire directory of images. eg. -d/Users/Peachy/Desktop/images")
         parser.add_argument('-f', '--file',  nargs=1, help="Processes an images file. eg. -f/Users/Peachy/Desktop/images/001.png")
+        parser.add_argument('-V', '--volume', nargs=1, help="Processes each slice of a (Z, Y, X) .npy volume or multi-page TIFF as a layer, ImageJ slice spacing overrides --height. eg. -V/Users/Peachy/Desktop/part.tif")
+        parser.add_argument('-R', '--runs', nargs=1, help="Writes gcode from a runs file saved by --save_runs. eg. -R/Users/Peachy/Desktop/images/photo.runs")
+        parser.add_argument('-T', '--stats_only', action='store_true', help="Reports size, extrusion, travel and time and saves a preview PNG to --output instead of writing gcode. eg. -T")
+        parser.add_argument('-e', '--speeds', default=[10.0, 100.0], type=float, nargs=2, help="Cutting and travel speeds in mm/s for the --stats_only time estimate. eg. -e 10 100")
         parser.add_argument('-o', '--output',  default=[], nargs=1, help="Output file. eg. -o/Users/Peachy/Desktop/images/photo.gcode")
+        parser.add_argument('-x', '--output_format', default=['gcode'], choices=['gcode', 'moves'], nargs=1, help="Writes gcode text, or compact binary moves made from the runs. eg. -xmoves")
+        parser.add_argument('-Z', '--compress', choices=['none', 'gzip', 'lzma'], nargs=1, help="Compresses the output while it is written, by default .gz and .xz outputs are compressed. eg. -Zgzip")
         parser.add_argument('-r', '--alternate_raster', action='store_true', help="Alternate rastering style eg. -r")
+        parser.add_argument('-O', '--optimize_travel', action='store_true', help="Reorders and reverses runs to shorten laser off travel. eg. -O")
+        parser.add_argument('-m', '--merge_rows', action='store_true', help="Joins matching runs in consecutive rows into serpentine strokes. eg. -m")
+        parser.add_argument('-c', '--column_major', action='store_true', help="Rasters along image columns instead of rows. eg. -c")
         parser.add_argument('-z', '--height', default=[0.1], type=float, nargs=1, help="The height of each layer when multipule images provided. eg. -z0.1")
+        parser.add_argument('-t', '--threshold', default=[0], type=int, nargs=1, help="Pixels with a luminance at or below this (0-255) are rastered, 0 only rasters exact black and transparent pixels count as white. eg. -t127")
+        parser.add_argument('-g', '--gray_levels', default=[0], type=int, nargs=1, help="Rasters luminance in this many levels (2-256) instead of black only, the lightest level is left off. eg. -g8")
+        parser.add_argument('-M', '--modulation', default=['power'], choices=['power', 'feed'], nargs=1, help="How gray levels are cut, with an S power of 0-1 or a slower feed for darker runs. eg. -Mfeed")
+        parser.add_argument('-p', '--packed', action='store_true', help="Keeps loaded images bit packed to save memory. eg. -p")
+        parser.add_argument('-s', '--strips', nargs=1, type=int, help="Reads and rasters images this many rows at a time to bound memory, fastest with uncompressed TIFF, BMP, PPM or NPY images. eg. -s512")
+        parser.add_argument('-j', '--jobs', default=[1], type=int, nargs=1, help="Number of processes used to rasterize a directory of images. eg. -j4")
+        parser.add_argument('-i', '--io_threads', default=[0], type=int, nargs=1, help="Reads images on this many threads and writes gcode on another while rastering, for slow or network disks. Ignored with --jobs. eg. -i2")
+        parser.add_argument('-D', '--diff_layers', action='store_true', help="Only rescans the rows of each layer that differ from the layer before, for stacks of similar layers. eg. -D")
+        parser.add_argument('-C', '--cache', nargs=1, help="Directory for cached layer runs, unchanged images are not rastered again. eg. -C/Users/Peachy/.peachyraster")
+        parser.add_argument('-S', '--cache_size', default=[1024], type=int, nargs=1, help="Largest size of the cache in megabytes. eg. -S512")
+        parser.add_argument('-P', '--profile', nargs=1, help="Writes per layer stage timings and counters to a JSON file and prints a summary. eg. -P/Users/Peachy/Desktop/profile.json")
+        parser.add_argument('-w', '--save_runs', nargs=1, help="Also saves the rastered runs to a file for later use with --runs. eg. -w/Users/Peachy/Desktop/images/photo.runs")
         parser.add_argument('-v', '--verbose', action='store_true', help="Enables verbose logging. eg. -l")
         self.args = parser.parse_args()
-        if not (self.args.file or self.args.directory):
-            parser.error('No action requested, add --file or --directory')
-        if (self.args.file and self.args.directory):
-            parser.error('Use only one of --file or --directory')
+        actions = [action for action in (self.args.file, self.args.directory, self.args.volume, self.args.runs) if action]
+        if not actions:
+            parser.error('No action requested, add --file, --directory, --volume or --runs')
+        if len(actions) > 1:
+            parser.error('Use only one of --file, --directory, --volume or --runs')
+        if (self.args.diff_layers and self.args.cache):
+            parser.error('Use only one of --diff_layers or --cache')
+        if (self.args.volume and self.args.cache):
+            parser.error('Volumes can not be used with --cache')
+        if (self.args.optimize_travel and self.args.merge_rows):
+            parser.error('Use only one of --optimize_travel or --merge_rows')
+        if (self.args.gray_levels[0] and self.args.merge_rows):
+            parser.error('Use only one of --gray_levels or --merge_rows')
+        if self.args.gray_levels[0] and not 2 <= self.args.gray_levels[0] <= 256:
+            parser.error('--gray_levels must be between 2 and 256')
         if self.args.verbose:
             logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
         else:
             logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='WARNING')
 
     def start(self):
+        # numpy and PIL are only imported once the arguments are good, so --help and usage errors return quickly
+        from peachyraster.raster import Raster
+        from peachyraster.cache import RunCache
         laser_width = self.args.kerf[0]
         border_size = self.args.border[0]
         output_file = self.args.output[0] if self.args.output else None
         layer_height = self.args.height[0]
         back_and_forth = self.args.alternate_raster
+        jobs = self.args.jobs[0]
+        threshold = self.args.threshold[0]
+        packed = self.args.packed
+        optimize_travel = self.args.optimize_travel
+        merge_rows = self.args.merge_rows
+        column_major = self.args.column_major
+        strip_rows = self.args.strips[0] if self.args.strips else None
+        runs_file = self.args.save_runs[0] if self.args.save_runs else None
+        profile_file = self.args.profile[0] if self.args.profile else None
+        io_threads = self.args.io_threads[0]
+        levels = self.args.gray_levels[0]
+        output_format = self.args.output_format[0]
+        compression = self.args.compress[0] if self.args.compress else None
+        diff_layers = self.args.diff_layers
+        stats_only = self.args.stats_only
+        speeds = tuple(self.args.speeds)
+        modulation = self.args.modulation[0]
+        cache = RunCache(self.args.cache[0], self.args.cache_size[0] * 1024 * 1024) if self.args.cache else None
         if self.args.file:
-            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth)
+            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth, threshold=threshold, packed=packed, optimize_travel=optimize_travel, merge_rows=merge_rows, column_major=column_major, cache=cache, runs_file_name=runs_file, strip_rows=strip_rows, profile_file_name=profile_file, levels=levels, modulation=modulation, output_format=output_format, compression=compression, diff_layers=diff_layers, stats_only=stats_only, speeds=speeds)
             raster.process_file(self.args.file[0])
+        elif self.args.volume:
+            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth, jobs=jobs, threshold=threshold, optimize_travel=optimize_travel, merge_rows=merge_rows, column_major=column_major, runs_file_name=runs_file, strip_rows=strip_rows, profile_file_name=profile_file, levels=levels, modulation=modulation, output_format=output_format, compression=compression, diff_layers=diff_layers, stats_only=stats_only, speeds=speeds)
+            raster.process_volume(self.args.volume[0])
+        elif self.args.runs:
+            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth, optimize_travel=optimize_travel, merge_rows=merge_rows, profile_file_name=profile_file, levels=levels, modulation=modulation, output_format=output_format, compression=compression, diff_layers=diff_layers, stats_only=stats_only, speeds=speeds)
+            raster.process_runs(self.args.runs[0])
         else:
-            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth)
+            raster = Raster(laser_width, border_size, output_file, layer_height, back_and_forth=back_and_forth, jobs=jobs, threshold=threshold, packed=packed, optimize_travel=optimize_travel, merge_rows=merge_rows, column_major=column_major, cache=cache, runs_file_name=runs_file, strip_rows=strip_rows, profile_file_name=profile_file, io_threads=io_threads, levels=levels, modulation=modulation, output_format=output_format, compression=compression, diff_layers=diff_layers, stats_only=stats_only, speeds=speeds)
             raster.process_folder(self.args.directory[0])
 
 
@@ -42,4 +102,7 @@ def main():
     Run().start()
 
 if __name__ == '__main__':
-    Run().start()
+    if not __package__:
+        # Run as a script, so the package is found in the directory above this file rather than as this file
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,130 @@
+import threading
+import contextlib
+import queue
+from timeit import default_timer
+
+DEPTH = 4
+BLOCKED = ['decode', 'raster_input', 'raster_output', 'write']
+
+
+class Pipeline(object):
+    '''Overlaps reading, rastering and writing of layers.
+
+    Decoder threads read up to depth items ahead of the rasterizer, which runs on the calling
+    thread and gets them back in order. Writes are handed to a background writer thread through
+    a queue of at most depth entries and done in the order given. The time each stage spends
+    waiting on its neighbours is kept in blocked.'''
+
+    def __init__(self, threads=2, depth=DEPTH):
+        self.threads = max(1, threads)
+        self.depth = max(1, depth)
+        self.blocked = dict((stage, 0.0) for stage in BLOCKED)
+        self._lock = threading.Lock()
+
+    def decoded(self, items, decode):
+        '''Yields decode(item) for each item in order while the following items are decoded on other threads.'''
+        items = list(items)
+        slots = [_Slot() for _ in items]
+        window = threading.Semaphore(self.depth)
+        taken = iter(range(len(items)))
+        stopped = []
+
+        def decoder():
+            while True:
+                start = default_timer()
+                window.acquire()
+                self._add('decode', default_timer() - start)
+                with self._lock:
+                    index = None if stopped else next(taken, None)
+                if index is None:
+                    window.release()
+                    return
+                slots[index].fill(decode, items[index])
+
+        threads = [_daemon(decoder) for _ in range(min(self.threads, len(items)))]
+        try:
+            for slot in slots:
+                start = default_timer()
+                slot.done.wait()
+                self._add('raster_input', default_timer() - start)
+                window.release()
+                yield slot.result()
+        finally:
+            with self._lock:
+                stopped.append(True)
+            for _ in threads:
+                window.release()
+            for thread in threads:
+                thread.join()
+
+    @contextlib.contextmanager
+    def writer(self):
+        '''Yields write(function, *args), which queues function(*args) for the writer thread.
+
+        Leaving the block waits for queued writes, and an error raised by one of them is raised here.'''
+        pending = queue.Queue(self.depth)
+        errors = []
+
+        def drain():
+            while True:
+                start = default_timer()
+                item = pending.get()
+                self._add('write', default_timer() - start)
+                if item is None:
+                    return
+                if not errors:
+                    function, args = item
+                    try:
+                        function(*args)
+                    except Exception as error:
+                        errors.append(error)
+
+        def write(function, *args):
+            if errors:
+                raise errors[0]
+            start = default_timer()
+            pending.put((function, args))
+            self._add('raster_output', default_timer() - start)
+
+        thread = _daemon(drain)
+        try:
+            yield write
+        finally:
+            pending.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def report(self):
+        return "Pipeline blocked: decode {:.2f}s, raster {:.2f}s on input and {:.2f}s on output, write {:.2f}s".format(
+            *[self.blocked[stage] for stage in BLOCKED])
+
+    def _add(self, stage, seconds):
+        with self._lock:
+            self.blocked[stage] += seconds
+
+
+class _Slot(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def fill(self, function, item):
+        try:
+            self.value = function(item)
+        except Exception as error:
+            self.error = error
+        self.done.set()
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _daemon(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -2,57 +2,430 @@ import logging
 import os.path
 import datetime
 import numpy as np
-from PIL import Image
 import time
+import multiprocessing
+import contextlib
+from .runs import LayerRuns, read_layers, encode_layer, encode_moves
+from .decode import load_mask, open_strips, require_file, pixels_to_luminance, Volume
+from .gcode import format_table, format_rows, choose_rows, table_to_text
+from .timing import Profiler, DISABLED
+from .pipeline import Pipeline
+from .sinks import OutputSink
+from .stats import PrintStats, CUT_SPEED, TRAVEL_SPEED
+from .pathing import plan_path, path_travel, merge_strokes, DEFAULT_TWO_OPT_BUDGET
+
+ROWS_PER_CHUNK = 64
+RUNS_PER_CHUNK = 4096
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'bmp', 'ppm', 'pgm', 'npy']
+MODULATIONS = ['power', 'feed']
+OUTPUT_FORMATS = ['gcode', 'moves']
 
 
 class Raster(object):
-    def __init__(self, laser_width=0.5, border_size=1, output_file_name=None, layer_height=0.1, back_and_forth=False):
+    def __init__(self, laser_width=0.5, border_size=1, output_file_name=None, layer_height=0.1, back_and_forth=False, jobs=1, threshold=0, packed=False, optimize_travel=False, merge_rows=False, column_major=False, cache=None, runs_file_name=None, strip_rows=None, profile_file_name=None, io_threads=0, levels=0, modulation='power', output_format='gcode', compression=None, diff_layers=False, stats_only=False, speeds=(CUT_SPEED, TRAVEL_SPEED)):
+        if diff_layers and cache:
+            raise ValueError("Layers can not be both diffed and cached")
         self.layer_height = layer_height
-        self.file_raster = ImageRaster(laser_width, border_size, back_and_forth=back_and_forth)
+        self.diff = LayerDiff() if diff_layers else None
+        self.stats = PrintStats(laser_width, *speeds) if stats_only else None
+        self.compression = compression
+        self.io_threads = io_threads
+        self.write = None
+        self.profile_file_name = profile_file_name
+        self.profiler = Profiler() if profile_file_name else DISABLED
+        self.strip_rows = strip_rows
+        self.cache = cache
+        self.runs_file_name = runs_file_name
+        self.runs_file = None
+        self.jobs = jobs
+        # Gray levels are quantized by the rasterizer from luminance, so images are not thresholded
+        self.threshold = None if levels else threshold
+        self.packed = packed
+        self.file_raster = ImageRaster(laser_width, border_size, back_and_forth=back_and_forth, optimize_travel=optimize_travel, merge_rows=merge_rows, column_major=column_major, profiler=self.profiler, levels=levels, modulation=modulation, output_format=output_format)
+        if strip_rows:
+            self.file_raster.rows_per_chunk = strip_rows
         if output_file_name:
             self.output_file_name = output_file_name
         else:
-            self.output_file_name = 'out{0}.gcode'.format(datetime.datetime.now().strftime('%Y-%b-%d-%H%M'))
+            self.output_file_name = 'out{0}.{1}'.format(datetime.datetime.now().strftime('%Y-%b-%d-%H%M'), 'png' if stats_only else output_format)
 
     def process_file(self, file_name):
         start = time.time()
-        with open(self.output_file_name, 'w') as output_file:
-            self._process_file(file_name, output_file, 0.0)
+        with self._open_output() as output_file:
+            with self._open_runs_file():
+                self._process_file(file_name, output_file, 0.0)
+        self._finish_cache()
+        self._finish_profile()
         total = time.time() - start
         print("Elapsed Time: {:.2f} seconds".format(total))
 
     def _process_file(self, file_name, output_file, height):
-        if os.path.isfile(file_name):
-            image = np.array(Image.open(file_name))
-            result = self.file_raster.process(image, height)
-            output_file.write(result)
-        else:
-            logging.error("File {0} could not be found.".format(file_name))
-            raise IOError("File Not Found")
+        self.profiler.start_layer(file_name)
+        if self.diff is not None:
+            image = _load(file_name, self.threshold, self.packed, self.strip_rows, self.profiler)
+            self._write_layer(self._find_runs(image), False, None, output_file, height)
+            return
+        if not self._keeps_runs():
+            # Runs are not kept, so gcode is written as each band is scanned and with strips only one band of the image is held
+            image = _load(file_name, self.threshold, self.packed, self.strip_rows, self.profiler)
+            self._write_chunks(self.file_raster.generate(image, height), output_file)
+            return
+        layer, hit, record = _find_file_runs(self._runs_job(file_name))
+        self._write_layer(layer, hit, record, output_file, height)
 
     def process_folder(self, folder_name):
         start = time.time()
         files = [os.path.join(folder_name, a_file) for a_file in os.listdir(folder_name) if os.path.isfile(os.path.join(folder_name, a_file))]
-        image_files = [image_file for image_file in files if image_file.split('.')[-1] in ['png', 'jpg', 'jpeg']]
+        image_files = [image_file for image_file in files if image_file.split('.')[-1] in IMAGE_EXTENSIONS]
         image_files.sort()
         height = 0.0
-        with open(self.output_file_name, 'w') as output_file:
-            for a_file in image_files:
-                print("Processing: {}".format(a_file))
-                self._process_file(a_file, output_file, height)
-                height += self.layer_height
+        with self._open_output() as output_file:
+            with self._open_runs_file():
+                # Each layer is diffed against the one before, so diffed layers are found in order here
+                if self.jobs > 1 and self.diff is None:
+                    self._process_files_in_parallel(image_files, output_file)
+                elif self.io_threads > 0:
+                    self._process_files_pipelined(image_files, output_file)
+                else:
+                    for a_file in image_files:
+                        print("Processing: {}".format(a_file))
+                        self._process_file(a_file, output_file, height)
+                        height += self.layer_height
+        self._finish_cache()
+        self._finish_profile()
+        total = time.time() - start
+        print("Elapsed Time: {:.2f} seconds".format(total))
+
+    def process_volume(self, volume_file_name):
+        '''Rasters each slice of a .npy volume or multi-page TIFF as a layer, spaced as the volume gives or by layer_height.'''
+        start = time.time()
+        if self.cache:
+            raise ValueError("Volumes can not be cached")
+        volume = Volume(volume_file_name, self.threshold)
+        layer_height = volume.spacing or self.layer_height
+        print("Volume: {0} layers {1}mm apart".format(len(volume), layer_height))
+        with self._open_output() as output_file, contextlib.closing(volume):
+            with self._open_runs_file():
+                if self.jobs > 1 and self.diff is None:
+                    self._process_volume_in_parallel(volume, output_file, layer_height)
+                else:
+                    for index in range(len(volume)):
+                        self.profiler.start_layer("{0}:{1}".format(volume_file_name, index))
+                        with self.profiler.stage('decode'):
+                            image = volume[index]
+                        if self._keeps_runs():
+                            self._write_layer(self._find_runs(image), False, None, output_file, index * layer_height)
+                        else:
+                            self._write_chunks(self.file_raster.generate(image, index * layer_height), output_file)
+        self._finish_profile()
         total = time.time() - start
         print("Elapsed Time: {:.2f} seconds".format(total))
 
+    def _process_volume_in_parallel(self, volume, output_file, layer_height):
+        # The volume is sent to each worker once, jobs only name a slice
+        jobs = [(index, self.file_raster.border_size, self.file_raster.column_major, self.file_raster.levels, self.strip_rows, self.profiler.enabled) for index in range(len(volume))]
+        pool = multiprocessing.Pool(self.jobs, _share_volume, (volume,))
+        try:
+            for index, (layer, record) in enumerate(pool.imap(_find_slice_runs, jobs)):
+                self.profiler.start_layer("{0}:{1}".format(volume.file_name, index))
+                self._write_layer(layer, False, record, output_file, index * layer_height)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def process_runs(self, runs_file_name):
+        start = time.time()
+        require_file(runs_file_name)
+        with self._open_output() as output_file:
+            for index, (layer, height) in enumerate(read_layers(runs_file_name)):
+                self.profiler.start_layer("{0}:{1}".format(runs_file_name, index))
+                self._use_levels(layer)
+                self._emit(layer, output_file, height)
+        self._finish_profile()
+        total = time.time() - start
+        print("Elapsed Time: {:.2f} seconds".format(total))
+
+    def _process_files_in_parallel(self, image_files, output_file):
+        # Workers only find runs; extrusion and direction carry over between layers so they are applied here in layer order
+        jobs = [self._runs_job(a_file) for a_file in image_files]
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            height = 0.0
+            for a_file, (layer, hit, record) in zip(image_files, pool.imap(_find_file_runs, jobs)):
+                print("Processing: {}".format(a_file))
+                self.profiler.start_layer(a_file)
+                self._write_layer(layer, hit, record, output_file, height)
+                height += self.layer_height
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _process_files_pipelined(self, image_files, output_file):
+        # Images are read on decoder threads and gcode written on a writer thread; rastering stays here so layers keep their order
+        pipeline = Pipeline(self.io_threads)
+        jobs = [self._runs_job(a_file) for a_file in image_files]
+        height = 0.0
+        try:
+            with pipeline.writer() as self.write:
+                for a_file, (image, layer, key, record) in zip(image_files, pipeline.decoded(jobs, _prefetch)):
+                    print("Processing: {}".format(a_file))
+                    self.profiler.start_layer(a_file)
+                    if layer is None and self.strip_rows and not self._keeps_runs():
+                        self.profiler.merge(record)
+                        self._write_chunks(self.file_raster.generate(image, height), output_file)
+                    else:
+                        hit = layer is not None
+                        if not hit:
+                            layer = self._find_runs(image)
+                            if self.cache:
+                                self.cache.put(key, layer)
+                        self._write_layer(layer, hit, record, output_file, height)
+                    height += self.layer_height
+        finally:
+            self.write = None
+        print(pipeline.report())
+
+    def _find_runs(self, image):
+        if self.diff is None:
+            return self.file_raster.find_runs(image)
+        layer = self.file_raster.find_runs(image, self.diff)
+        self.profiler.count('reused_rows', self.diff.reused)
+        print("Reused {:.1f}% of rows".format(self.diff.reused_percent()))
+        return layer
+
+    def _write_layer(self, layer, hit, record, output_file, height):
+        self.profiler.merge(record)
+        if self.cache:
+            self.cache.record(hit)
+        if self.runs_file:
+            self._timed_write(layer.write, self.runs_file, height)
+        self._emit(layer, output_file, height)
+
+    def _emit(self, layer, output_file, height):
+        if self.stats is not None:
+            with self.profiler.stage('plan'):
+                self.stats.add(layer, *self.file_raster.plan(layer))
+        else:
+            self._write_chunks(self.file_raster.generate_runs(layer, height), output_file)
+
+    def _use_levels(self, layer):
+        # Gray runs are cut in the levels they were rastered in, whatever levels this raster was set up with
+        levels = self.file_raster.levels
+        if layer.levels is None:
+            return
+        if levels and levels != layer.level_count:
+            raise ValueError("Runs were rastered in {0} gray levels, not {1}".format(layer.level_count, levels))
+        if self.file_raster.merge_rows:
+            raise ValueError("Rows can not be merged when rastering in gray levels")
+        self.file_raster.levels = layer.level_count
+
+    def _keeps_runs(self):
+        # Layers are streamed band by band unless their runs are needed whole
+        return bool(self.cache or self.runs_file or self.diff is not None or self.stats is not None)
+
+    def _write_chunks(self, chunks, output_file):
+        for chunk in chunks:
+            self._timed_write(output_file.write, chunk)
+            self.profiler.count('bytes', len(chunk))
+
+    def _timed_write(self, function, *args):
+        if self.write:
+            self.write(_write_into, self.profiler, self.profiler.layer, function, args)
+        else:
+            _write_into(self.profiler, self.profiler.layer, function, args)
+
+    @contextlib.contextmanager
+    def _open_output(self):
+        if self.stats is not None:
+            yield None
+            self.stats.save_preview(self.output_file_name)
+            print(self.stats.report())
+            print("Preview: {0}".format(self.output_file_name))
+            return
+        with OutputSink(self.output_file_name, self.compression) as output_file:
+            yield output_file
+        if output_file.compression != 'none':
+            print(output_file.report())
+
+    @contextlib.contextmanager
+    def _open_runs_file(self):
+        if not self.runs_file_name:
+            yield
+            return
+        with open(self.runs_file_name, 'wb') as self.runs_file:
+            yield
+        self.runs_file = None
+
+    def _runs_job(self, file_name):
+        return (file_name, self.file_raster.border_size, self.threshold, self.packed, self.strip_rows, self.file_raster.column_major, self.file_raster.levels, self.cache, self.profiler.enabled)
+
+    def _finish_cache(self):
+        if self.cache:
+            self.cache.evict()
+            print(self.cache.report())
+
+    def _finish_profile(self):
+        if self.profiler.enabled:
+            self.profiler.write(self.profile_file_name)
+            print(self.profiler.report())
+
+
+def _find_file_runs(job):
+    # Timings are collected here, possibly in a worker process, and returned for the parent to merge
+    file_name, border_size, threshold, packed, strip_rows, column_major, levels, cache, profile = job
+    profiler = _job_profiler(job)
+    image, layer, key = _read_input(job, profiler)
+    if layer is not None:
+        return layer, True, profiler.layer
+    image_raster = ImageRaster(0, border_size, column_major=column_major, rows_per_chunk=strip_rows or ROWS_PER_CHUNK, profiler=profiler, levels=levels)
+    layer = image_raster.find_runs(image)
+    if cache is not None:
+        cache.put(key, layer)
+    return layer, False, profiler.layer
+
+
+_volume = None
+
+
+def _share_volume(volume):
+    global _volume
+    _volume = volume
+
+
+def _find_slice_runs(job):
+    index, border_size, column_major, levels, strip_rows, profile = job
+    profiler = _job_profiler(job)
+    image_raster = ImageRaster(0, border_size, column_major=column_major, rows_per_chunk=strip_rows or ROWS_PER_CHUNK, profiler=profiler, levels=levels)
+    with profiler.stage('decode'):
+        image = _volume[index]
+    return image_raster.find_runs(image), profiler.layer
+
+
+def _prefetch(job):
+    # Runs on a decoder thread, so its timings go to a record of its own
+    profiler = _job_profiler(job)
+    return _read_input(job, profiler) + (profiler.layer,)
+
+
+def _job_profiler(job):
+    profiler = Profiler() if job[-1] else DISABLED
+    profiler.start_layer(job[0])
+    return profiler
+
+
+def _read_input(job, profiler):
+    '''Returns (image, None, key), or (None, layer, key) when the runs are already in the cache.'''
+    file_name, border_size, threshold, packed, strip_rows, column_major, levels, cache, profile = job
+    if cache is None:
+        return _load(file_name, threshold, packed, strip_rows, profiler), None, None
+    require_file(file_name)
+    with profiler.stage('decode'):
+        key = cache.key(file_name, border_size, threshold, column_major, levels)
+        layer = cache.get(key)
+    if layer is not None:
+        return None, layer, key
+    return _load(file_name, threshold, packed, strip_rows, profiler), None, key
+
+
+def _load(file_name, threshold, packed, strip_rows, profiler):
+    with profiler.stage('decode'):
+        if strip_rows:
+            return open_strips(file_name, threshold)
+        return load_mask(file_name, threshold, packed)
+
+
+def _write_into(profiler, record, function, args):
+    with profiler.stage('write', record):
+        function(*args)
+
+
+class _ColumnBands(object):
+    '''A strip or packed mask seen transposed, so each band of rows sliced from it reads only a band of its columns.'''
+
+    def __init__(self, image):
+        self.image = image
+        self.shape = (image.shape[1], image.shape[0])
+
+    def __getitem__(self, columns):
+        return np.swapaxes(self.image.columns(columns), 0, 1)
+
+
+class LayerDiff(object):
+    '''Keeps the scanned rows and runs of the last layer so the next layer only rescans rows that changed.
+
+    Runs hold no extrusion, so reused rows are emitted with extrusion worked out afresh.'''
+
+    def __init__(self):
+        self.values = None
+        self.layer = None
+        self.rows = 0
+        self.reused = 0
+        self._bands = []
+
+    def start(self, shape):
+        if self.values is not None and self.values.shape != shape:
+            self.values = None
+        self.rows = 0
+        self.reused = 0
+        self._bands = []
+
+    def scan(self, values, first_row, scan):
+        '''Returns the runs of a band of rows, which start at bordered row first_row, relative to the band.'''
+        previous = None if self.values is None else self.values[self.rows:self.rows + len(values)]
+        self._bands.append(values)
+        self.rows += len(values)
+        if previous is None:
+            return scan(values)
+        changed = np.any((values != previous).reshape(len(values), -1), axis=1)
+        changed_rows = np.nonzero(changed)[0]
+        self.reused += len(values) - len(changed_rows)
+        rows, starts, ends, levels = scan(values[changed_rows])
+        lower, upper = np.searchsorted(self.layer.rows, [first_row, first_row + len(values)])
+        kept_rows = self.layer.rows[lower:upper].astype(np.intp) - first_row
+        kept = np.nonzero(~changed[kept_rows])[0] + lower
+        rows = np.concatenate([self.layer.rows[kept].astype(np.intp) - first_row, changed_rows[rows]])
+        starts = np.concatenate([self.layer.starts[kept], starts])
+        ends = np.concatenate([self.layer.ends[kept], ends])
+        order = np.lexsort((starts, rows))
+        if levels is not None:
+            levels = np.concatenate([self.layer.levels[kept], levels])[order]
+        return rows[order], starts[order], ends[order], levels
+
+    def finish(self, layer):
+        self.values = np.concatenate(self._bands) if self._bands else None
+        self.layer = layer
+        self._bands = []
+
+    def reused_percent(self):
+        return 100.0 * self.reused / self.rows if self.rows else 0.0
+
 
 class ImageRaster(object):
-    def __init__(self, laser_width, border_size, back_and_forth=False):
+    def __init__(self, laser_width, border_size, back_and_forth=False, reference=False, rows_per_chunk=ROWS_PER_CHUNK, optimize_travel=False, two_opt_budget=DEFAULT_TWO_OPT_BUDGET, merge_rows=False, column_major=False, profiler=DISABLED, levels=0, modulation='power', output_format='gcode'):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Output format must be one of {0}".format(', '.join(OUTPUT_FORMATS)))
+        if levels and not 2 <= levels <= 256:
+            raise ValueError("Gray levels must be between 2 and 256")
+        if levels and merge_rows:
+            raise ValueError("Rows can not be merged when rastering in gray levels")
+        if modulation not in MODULATIONS:
+            raise ValueError("Modulation must be one of {0}".format(', '.join(MODULATIONS)))
         self.laser_width = laser_width
-        self.border_size = border_size
+        self.profiler = profiler
+        self.border_size = int(border_size)
         self.extrude = 0.0
         self.back_and_forth = back_and_forth
         self.is_forward = True
+        self.reference = reference
+        self.rows_per_chunk = rows_per_chunk
+        self.optimize_travel = optimize_travel
+        self.two_opt_budget = two_opt_budget
+        self.merge_rows = merge_rows
+        self.column_major = column_major
+        self.levels = levels
+        self.modulation = modulation
+        self.binary = output_format == 'moves'
+        self.transposed = False
 
     def print_ascii(self, image):
         string = '\n'
@@ -66,6 +439,314 @@ class ImageRaster(object):
         return string + '\n-------\n'
 
     def process(self, image, height=0.0):
+        return (b'' if self.binary else '').join(self.generate(image, height))
+
+    def generate(self, image, height=0.0):
+        if self.reference:
+            for chunk in self._generate_reference(image, height):
+                yield chunk
+            return
+        if self.merge_rows or self.optimize_travel:
+            for chunk in self.generate_runs(self.find_runs(image), height):
+                yield chunk
+            return
+        # Scan order only needs one band of runs at a time, so bands are emitted as they are found
+        layer = self._layer_shape(image)
+        for chunk in self._generate_header(layer, height):
+            yield chunk
+        for (first_row, row_count, rows, starts, ends, levels) in self._band_runs(image):
+            chunk = self._runs_to_gcode(rows, starts, ends, first_row, row_count, levels)
+            if chunk:
+                yield chunk
+
+    def find_runs(self, image, diff=None):
+        '''Finds the runs of a layer. Given the LayerDiff of the layer before, only rows that changed since it are scanned.'''
+        layer = self._layer_shape(image)
+        rows, starts, ends, levels = zip(*[band[2:] for band in self._band_runs(image, diff)])
+        levels = np.concatenate(levels) if self.levels else None
+        layer = LayerRuns(layer.width, layer.height, np.concatenate(rows), np.concatenate(starts), np.concatenate(ends), transposed=layer.transposed, levels=levels, level_count=self.levels)
+        if diff is not None:
+            diff.finish(layer)
+        return layer
+
+    def _layer_shape(self, image):
+        empty = np.zeros(0, dtype=np.int32)
+        border = self.border_size
+        if self.column_major:
+            return LayerRuns(image.shape[0] + 2 * border, image.shape[1] + 2 * border, empty, empty, empty, transposed=True)
+        return LayerRuns(image.shape[1] + 2 * border, image.shape[0] + 2 * border, empty, empty, empty)
+
+    def _band_runs(self, image, diff=None):
+        # Borders are never materialized: border rows are whole runs and border columns extend the edge runs
+        if self.column_major:
+            with self.profiler.stage('decode'):
+                image = np.swapaxes(image, 0, 1) if isinstance(image, np.ndarray) else _ColumnBands(image)
+        if diff is not None:
+            diff.start(image.shape[:2])
+        border = self.border_size
+        width = image.shape[1] + 2 * border
+        if self._never_black(image):
+            empty = np.zeros(0, dtype=np.intp)
+            yield (0, image.shape[0] + 2 * border, empty, empty, empty, None)
+            return
+        with self.profiler.stage('border'):
+            top = self._border_runs(0, width)
+        yield (0, border) + top
+        for first_row in range(0, image.shape[0], self.rows_per_chunk):
+            with self.profiler.stage('decode'):
+                band = image[first_row:first_row + self.rows_per_chunk]
+            with self.profiler.stage('scan'):
+                values = self._band_levels(band) if self.levels else self._black_mask(band)
+                if diff is None:
+                    rows, starts, ends, levels = self._scan_values(values)
+                else:
+                    rows, starts, ends, levels = diff.scan(values, first_row + border, self._scan_values)
+            yield (first_row + border, band.shape[0], rows + first_row + border, starts, ends, levels)
+        with self.profiler.stage('border'):
+            bottom = self._border_runs(image.shape[0] + border, width)
+        yield (image.shape[0] + border, border) + bottom
+
+    def generate_runs(self, layer, height=0.0):
+        for chunk in self._generate_header(layer, height):
+            yield chunk
+        if self.merge_rows:
+            chunks = self._merged_chunks(layer)
+        elif self.optimize_travel:
+            chunks = self._optimized_chunks(layer)
+        else:
+            chunks = self._scan_chunks(layer)
+        for chunk in chunks:
+            yield chunk
+
+    def plan(self, layer):
+        '''Returns the run order, directions and relative feeds generate_runs would cut a layer with, and
+        carries extrusion and direction on to the next layer the same way.'''
+        if self.merge_rows:
+            order, forward, _ = merge_strokes(layer.rows, layer.starts, layer.ends, layer.width)
+        elif self.optimize_travel:
+            order, forward = plan_path(layer.rows, layer.starts, layer.ends, self.two_opt_budget)
+        else:
+            # Band by band direction changes add up to alternating rows from the direction the layer starts in
+            if self.back_and_forth:
+                forward = (layer.rows % 2 == 0) == self.is_forward
+                if layer.height % 2:
+                    self.is_forward = not self.is_forward
+            else:
+                forward = np.ones(len(layer), dtype=bool)
+            run_index = np.arange(len(layer))
+            order = np.lexsort((np.where(forward, run_index, -run_index), layer.rows))
+            forward = forward[order]
+        self.extrude += layer.extrusion()
+        feeds = None
+        if layer.levels is not None and self.modulation == 'feed':
+            feeds = (self.levels - 1) / layer.levels.astype(np.float64)
+        return order, forward, feeds
+
+    def _generate_header(self, layer, height):
+        self.transposed = layer.transposed
+        if layer.transposed:
+            self.max_y_pix = layer.width
+            self.max_x_pix = layer.height
+        else:
+            self.max_y_pix = layer.height
+            self.max_x_pix = layer.width
+        logging.info("Image Dimensions: width: {0} height: {1}".format(self.max_x_pix, self.max_y_pix))
+        logging.info("Laser width: {0} ".format(self.laser_width))
+        print("Final Image Dimensions: width: {0}mm height: {1}mm".format(self.max_x_pix * self.laser_width, self.max_y_pix * self.laser_width))
+        self.profiler.count('pixels', layer.width * layer.height)
+
+        if self.binary:
+            yield encode_layer(layer.width, layer.height, layer.transposed, height, self.laser_width, self.levels, self.modulation)
+        else:
+            yield "G1 Z{:.2f} F1\n".format(height)
+
+    def _scan_chunks(self, layer):
+        band_starts = list(range(0, layer.height, self.rows_per_chunk))
+        bounds = np.searchsorted(layer.rows, band_starts + [layer.height]).tolist()
+        for index, first_row in enumerate(band_starts):
+            lower, upper = bounds[index], bounds[index + 1]
+            row_count = min(self.rows_per_chunk, layer.height - first_row)
+            levels = None if layer.levels is None else layer.levels[lower:upper]
+            chunk = self._runs_to_gcode(layer.rows[lower:upper], layer.starts[lower:upper], layer.ends[lower:upper], first_row, row_count, levels)
+            if chunk:
+                yield chunk
+
+    def _optimized_chunks(self, layer):
+        with self.profiler.stage('plan'):
+            order, forward = plan_path(layer.rows, layer.starts, layer.ends, self.two_opt_budget)
+            scan_travel = path_travel(layer.rows, layer.starts, layer.ends, np.arange(len(layer)), np.ones(len(layer), dtype=bool))
+            travel = path_travel(layer.rows, layer.starts, layer.ends, order, forward)
+        print("Travel: {:.2f}mm in scan order, {:.2f}mm optimized".format(scan_travel * self.laser_width, travel * self.laser_width))
+        for lower in range(0, len(order), RUNS_PER_CHUNK):
+            index = order[lower:lower + RUNS_PER_CHUNK]
+            levels = None if layer.levels is None else layer.levels[index]
+            yield self._format_runs(layer.rows[index], layer.starts[index], layer.ends[index], forward[lower:lower + RUNS_PER_CHUNK], levels)
+
+    def _merged_chunks(self, layer):
+        with self.profiler.stage('plan'):
+            order, forward, stroke_starts = merge_strokes(layer.rows, layer.starts, layer.ends, layer.width)
+        for lower in range(0, len(order), RUNS_PER_CHUNK):
+            index = order[lower:lower + RUNS_PER_CHUNK]
+            upper = lower + RUNS_PER_CHUNK
+            yield self._format_strokes(layer.rows[index], layer.starts[index], layer.ends[index], forward[lower:upper], stroke_starts[lower:upper])
+
+    def _never_black(self, image):
+        # The reference compares pixels against [0, 0, 0], so with any other channel count neither pixels nor border are cut
+        return not self.levels and len(image.shape) == 3 and image.shape[2] != 3
+
+    def _black_mask(self, image):
+        if image.dtype == bool:
+            return image
+        if image.ndim != 3:
+            return np.zeros(image.shape[:2], dtype=bool)
+        return np.all(image == 0, axis=2)
+
+    def _scan_values(self, values):
+        if self.levels:
+            return self._level_runs(values)
+        return self._mask_runs(values) + (None,)
+
+    def _border_runs(self, first_row, width):
+        rows = np.arange(first_row, first_row + self.border_size)
+        levels = np.full(len(rows), self.levels - 1, dtype=np.uint8) if self.levels else None
+        return rows, np.zeros_like(rows), np.full_like(rows, width), levels
+
+    def _band_levels(self, image):
+        # Darkness is split into equal bands, the lightest of which, level 0, is off
+        if image.dtype == bool:
+            return np.where(image, self.levels - 1, 0).astype(np.uint8)
+        darkness = 255 - pixels_to_luminance(image).astype(np.int32)
+        return ((darkness * self.levels) >> 8).astype(np.uint8)
+
+    def _level_runs(self, levels):
+        # Rows are scanned as [0, border, levels..., border, 0]; a run ends wherever the level changes
+        border = self.border_size
+        padded = np.zeros((levels.shape[0], levels.shape[1] + 2 * border + 2), dtype=np.uint8)
+        padded[:, 1:-1] = self.levels - 1
+        padded[:, 1 + border:1 + border + levels.shape[1]] = levels
+        rows, columns = np.nonzero(padded[:, 1:] != padded[:, :-1])
+        run_levels = padded[rows, columns + 1]
+        # A run that is not off always ends at the next change in the same row, at the latest at the closing 0
+        lit = np.nonzero(run_levels)[0]
+        return rows[lit], columns[lit], columns[lit + 1], run_levels[lit]
+
+    def _mask_runs(self, mask):
+        # Each row is scanned as [0, border, mask..., border, 0] where a border column stands in for the whole border
+        border = self.border_size
+        width = mask.shape[1]
+        edges = np.zeros((mask.shape[0], width + 3), dtype=np.int8)
+        edges[:, 2:-1] = mask
+        edges[:, 1:-2] -= mask
+        if border:
+            edges[:, 0] -= 1
+            edges[:, 1] += 1
+            edges[:, -2] -= 1
+            edges[:, -1] += 1
+        # edges[:, i] is column[i] - column[i + 1]: -1 where a run starts at i + 1, 1 where a run ends just before i + 1
+        rows, starts = np.nonzero(edges == -1)
+        ends = np.nonzero(edges == 1)[1]
+        starts = np.where(starts == 0, 0, starts + border - 1)
+        ends = np.where(ends == width + 2, width + 2 * border, ends + border - 1)
+        return rows, starts, ends
+
+    def _runs_to_gcode(self, rows, starts, ends, first_row, row_count, levels=None):
+        if self.back_and_forth:
+            is_forward = self.is_forward
+            if row_count % 2:
+                self.is_forward = not self.is_forward
+        if len(rows) == 0:
+            return ''
+
+        if self.back_and_forth:
+            forward = ((rows - first_row) % 2 == 0) == is_forward
+        else:
+            forward = np.ones(len(rows), dtype=bool)
+        run_index = np.arange(len(rows))
+        order = np.lexsort((np.where(forward, run_index, -run_index), rows))
+        return self._format_runs(rows[order], starts[order], ends[order], forward[order], None if levels is None else levels[order])
+
+    def _format_runs(self, rows, starts, ends, forward, levels=None):
+        if self.binary:
+            return self._encode_moves(rows, starts, ends, forward, self._joined(rows, starts, ends, forward), levels)
+        if levels is not None:
+            return self._format_levels(rows, starts, ends, forward, levels)
+        self.profiler.count('runs', len(rows))
+        self.profiler.count('g0_moves', len(rows))
+        self.profiler.count('g1_moves', len(rows))
+        with self.profiler.stage('format'):
+            return format_table(["G0 F1 X", " Y", " E0.00\nG1 F1 X", " Y", " E", "\n"], self._moves(rows, starts, ends, forward))
+
+    def _format_levels(self, rows, starts, ends, forward, levels):
+        # A run that starts where the previous one stopped only changes power or feed, so it needs no travel move
+        joined = self._joined(rows, starts, ends, forward)
+        self.profiler.count('runs', len(rows))
+        self.profiler.count('g0_moves', len(rows) - int(np.count_nonzero(joined)))
+        self.profiler.count('g1_moves', len(rows))
+        with self.profiler.stage('format'):
+            x_from, y_from, x_to, y_to, extrudes = self._moves(rows, starts, ends, forward)
+            if self.modulation == 'feed':
+                # Darker runs are cut slower, full power runs at the F1 used for binary rasters
+                move, columns = ["G1 F", " X", " Y", " E", "\n"], [(self.levels - 1) / levels.astype(np.float64), x_to, y_to, extrudes]
+            else:
+                move, columns = ["G1 F1 X", " Y", " E", " S", "\n"], [x_to, y_to, extrudes, levels / float(self.levels - 1)]
+            start = format_rows(["G0 F1 X", " Y", " E0.00\n" + move[0]] + move[1:], [x_from, y_from] + columns)
+            step = format_rows(move, columns)
+            return table_to_text(choose_rows(~joined, start, step))
+
+    def _joined(self, rows, starts, ends, forward):
+        joined = np.zeros(len(rows), dtype=bool)
+        joined[1:] = (rows[1:] == rows[:-1]) & (forward[1:] == forward[:-1]) & np.where(forward[1:], starts[1:] == ends[:-1], ends[1:] == starts[:-1])
+        return joined
+
+    def _encode_moves(self, rows, starts, ends, forward, joined, levels):
+        # Extrusion is not stored, a reader sums the lengths of the moves
+        self.profiler.count('runs', len(rows))
+        with self.profiler.stage('format'):
+            self.extrude += float(np.sum(ends - starts, dtype=np.int64))
+            last = ends - 1
+            return encode_moves(rows, np.where(forward, starts, last), np.where(forward, last, starts), joined, levels)
+
+    def _format_strokes(self, rows, starts, ends, forward, stroke_starts):
+        if self.binary:
+            return self._encode_moves(rows, starts, ends, forward, ~stroke_starts, None)
+        # Within a stroke only one axis changes per move, so the unchanged axis is left out
+        strokes = int(np.count_nonzero(stroke_starts))
+        self.profiler.count('runs', len(rows))
+        self.profiler.count('g0_moves', strokes)
+        self.profiler.count('g1_moves', 2 * len(rows) - strokes)
+        with self.profiler.stage('format'):
+            x_from, y_from, x_to, y_to, extrudes = self._moves(rows, starts, ends, forward)
+            if self.transposed:
+                start = format_rows(["G0 F1 X", " Y", " E0.00\nG1 F1 Y", " E", "\n"], [x_from, y_from, y_to, extrudes])
+                step = format_rows(["G1 F1 X", "\nG1 F1 Y", " E", "\n"], [x_from, y_to, extrudes])
+            else:
+                start = format_rows(["G0 F1 X", " Y", " E0.00\nG1 F1 X", " E", "\n"], [x_from, y_from, x_to, extrudes])
+                step = format_rows(["G1 F1 Y", "\nG1 F1 X", " E", "\n"], [y_from, x_to, extrudes])
+            return table_to_text(choose_rows(stroke_starts, start, step))
+
+    def _moves(self, rows, starts, ends, forward):
+        lengths = (ends - starts).astype(np.float64)
+        extrudes = np.cumsum(lengths) + self.extrude
+        if len(extrudes):
+            self.extrude = float(extrudes[-1])
+
+        last = ends - 1
+        x_from, y_from = self._real_points(rows, np.where(forward, starts, last))
+        x_to, y_to = self._real_points(rows, np.where(forward, last, starts))
+        return [x_from, y_from, x_to, y_to, extrudes]
+
+    def _real_points(self, rows, columns):
+        if self.transposed:
+            rows, columns = columns, rows
+        # Stored runs may use unsigned columns, which must not wrap when offset
+        rows = rows.astype(np.int64)
+        x_offset = ((self.max_x_pix - 1) * self.laser_width) / 2.0
+        y_offset = ((self.max_y_pix + 1) * self.laser_width) / 2.0
+        x = columns * self.laser_width - x_offset
+        y = (self.max_y_pix - rows) * self.laser_width - y_offset
+        return x, y
+
+    def _generate_reference(self, image, height=0.0):
         image = self._add_borders(image)
         self.max_y_pix = image.shape[0]
         self.max_x_pix = image.shape[1]
@@ -76,11 +757,10 @@ class ImageRaster(object):
         logging.info("Laser width: {0} ".format(self.laser_width))
         print("Final Image Dimensions: width: {0}mm height: {1}mm".format(self.max_x_pix * self.laser_width, self.max_y_pix * self.laser_width))
 
-        gcode = "G1 Z{:.2f} F1\n".format(height)
+        yield "G1 Z{:.2f} F1\n".format(height)
         for y in range(0, self.max_y_pix):
             logging.info("Processing row {} of {}".format(y, self.max_y_pix))
-            gcode += self._process_column(image[y], y)
-        return gcode
+            yield self._process_column(image[y], y)
 
     def _process_column(self, column, current_row):
         if self.back_and_forth:
@@ -125,10 +805,7 @@ class ImageRaster(object):
         return (x_pos, y_pos)
 
     def _add_borders(self, image):
-        vborder = np.zeros((image.shape[0], self.border_size, image.shape[2]))
-        toped = np.append(vborder, image, axis=1)
-        bottomed = np.append(toped, vborder, axis=1)
-        hborder = np.zeros((self.border_size, bottomed.shape[1], bottomed.shape[2]))
-        lefted = np.append(hborder, bottomed, axis=0)
-        righted = np.append(lefted, hborder, axis=0)
-        return righted
+        border = self.border_size
+        bordered = np.zeros((image.shape[0] + 2 * border, image.shape[1] + 2 * border, image.shape[2]), dtype=image.dtype)
+        bordered[border:border + image.shape[0], border:border + image.shape[1]] = image
+        return bordered
@@ -0,0 +1,203 @@
+import os.path
+import struct
+import numpy as np
+
+RUNS_MAGIC = b'PRUN'
+RUNS_VERSION = 1
+TRANSPOSED = 1
+WIDE_COLUMNS = 2
+LEVELS = 4
+FEED = 8
+ALIGNMENT = 8
+
+MOVES_MAGIC = b'PMOV'
+MOVES_VERSION = 1
+LAYER_RECORD = 1
+MOVES_RECORD = 2
+
+# magic, version, flags, gray level count, width, height, run count, layer height
+_HEADER = struct.Struct('<4sBBHIIIxxxxd')
+# magic, version, record kind, flags, then width, height, layer height, laser width and gray level count for a layer or a move count for moves
+_LAYER_RECORD = struct.Struct('<4sBBBxIIddIxxxx')
+_MOVES_RECORD = struct.Struct('<4sBBBxIxxxx')
+
+
+class LayerRuns(object):
+    '''Runs of black pixels in a bordered layer, in row-major order with exclusive ends.
+
+    Runs carry no extrusion or direction state so they can be found out of order and
+    emitted later by ImageRaster.generate_runs. A transposed layer was scanned column by
+    column, so its rows are image columns and width and height are swapped. Layers rastered
+    in gray have the level of each run in levels, out of level_count, otherwise levels is None.'''
+
+    def __init__(self, width, height, rows, starts, ends, transposed=False, levels=None, level_count=0):
+        self.width = width
+        self.height = height
+        self.transposed = transposed
+        self.rows = _compact(rows)
+        self.starts = _compact(starts)
+        self.ends = _compact(ends)
+        self.levels = None if levels is None else np.asarray(levels, dtype=np.uint8)
+        self.level_count = 0 if levels is None else level_count
+
+    def __len__(self):
+        return len(self.rows)
+
+    def extrusion(self):
+        return float(np.sum(self.ends - self.starts, dtype=np.int64))
+
+    def write(self, runs_file, height=0.0):
+        '''Appends the layer to a binary runs file: a header, then per-row offsets into the start and end columns,
+        then the levels of gray layers.'''
+        flags = TRANSPOSED if self.transposed else 0
+        arrays = []
+        if self.levels is not None:
+            flags |= LEVELS
+            arrays = [self.levels]
+        column_type = np.uint16
+        if self.width > np.iinfo(np.uint16).max:
+            flags |= WIDE_COLUMNS
+            column_type = np.uint32
+        runs_file.write(_HEADER.pack(RUNS_MAGIC, RUNS_VERSION, flags, self.level_count, self.width, self.height, len(self), height))
+        offsets = np.searchsorted(self.rows, np.arange(self.height + 1))
+        for values in [offsets.astype(np.uint32), self.starts.astype(column_type), self.ends.astype(column_type)] + arrays:
+            data = values.tobytes()
+            runs_file.write(data + b'\0' * _padding(len(data)))
+
+    def save(self, file_name):
+        with open(file_name, 'wb') as runs_file:
+            self.write(runs_file)
+
+    @classmethod
+    def load(cls, file_name):
+        for layer, _ in read_layers(file_name):
+            return layer
+        raise ValueError("No layers in {0}".format(file_name))
+
+
+def read_layers(file_name):
+    '''Yields each layer in a runs file with its height. Start and end columns are memory mapped, not read.'''
+    if os.path.getsize(file_name) == 0:
+        return
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    position = 0
+    while position < len(data):
+        magic, version, flags, level_count, width, height, count, layer_height = _HEADER.unpack_from(data, position)
+        if magic != RUNS_MAGIC or version != RUNS_VERSION:
+            raise ValueError("{0} is not a version {1} runs file".format(file_name, RUNS_VERSION))
+        position += _HEADER.size
+        column_type = np.uint32 if flags & WIDE_COLUMNS else np.uint16
+        offsets, position = _read_array(data, position, np.uint32, height + 1)
+        starts, position = _read_array(data, position, column_type, count)
+        ends, position = _read_array(data, position, column_type, count)
+        levels = None
+        if flags & LEVELS:
+            levels, position = _read_array(data, position, np.uint8, count)
+        rows = np.repeat(np.arange(height, dtype=np.int32), np.diff(offsets).astype(np.intp))
+        yield LayerRuns(width, height, rows, starts, ends, transposed=bool(flags & TRANSPOSED), levels=levels, level_count=level_count), layer_height
+
+
+class MoveLayer(object):
+    '''A layer read from a binary moves file.
+
+    Each move cuts along row from column first to column last inclusive, so backward moves have
+    last below first. A joined move is reached from the end of the previous move without a G0 travel.
+    Rows, columns, width and height are in bordered pixels as in LayerRuns. Gray moves have
+    levels out of level_count, cut at level / (level_count - 1) power or feed by modulation.'''
+
+    def __init__(self, width, height, layer_height, laser_width, transposed, rows, firsts, lasts, joined, levels, level_count=0, modulation='power'):
+        self.width = width
+        self.height = height
+        self.layer_height = layer_height
+        self.laser_width = laser_width
+        self.transposed = transposed
+        self.rows = rows
+        self.firsts = firsts
+        self.lasts = lasts
+        self.joined = joined
+        self.levels = levels
+        self.level_count = level_count
+        self.modulation = modulation
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def encode_layer(width, height, transposed, layer_height, laser_width, level_count=0, modulation='power'):
+    '''Starts a layer in a binary moves file, the moves that follow belong to it.'''
+    flags = (TRANSPOSED if transposed else 0) | (FEED if modulation == 'feed' else 0)
+    return _LAYER_RECORD.pack(MOVES_MAGIC, MOVES_VERSION, LAYER_RECORD, flags, width, height, layer_height, laser_width, level_count)
+
+
+def encode_moves(rows, firsts, lasts, joined, levels=None):
+    '''Packs moves in the order they are cut, reusing the run columns instead of formatting coordinates.'''
+    flags = 0
+    column_type = np.uint16
+    if len(rows) and max(int(np.max(firsts)), int(np.max(lasts))) > np.iinfo(np.uint16).max:
+        flags |= WIDE_COLUMNS
+        column_type = np.uint32
+    arrays = [np.asarray(rows, dtype=np.uint32), np.asarray(firsts).astype(column_type), np.asarray(lasts).astype(column_type), np.asarray(joined, dtype=np.uint8)]
+    if levels is not None:
+        flags |= LEVELS
+        arrays.append(np.asarray(levels, dtype=np.uint8))
+    parts = [_MOVES_RECORD.pack(MOVES_MAGIC, MOVES_VERSION, MOVES_RECORD, flags, len(rows))]
+    for values in arrays:
+        data = values.tobytes()
+        parts.append(data + b'\0' * _padding(len(data)))
+    return b''.join(parts)
+
+
+def read_moves(file_name):
+    '''Yields each MoveLayer in a binary moves file, with its moves joined across records.'''
+    data = np.memmap(file_name, dtype=np.uint8, mode='r') if os.path.getsize(file_name) else np.zeros(0, dtype=np.uint8)
+    position = 0
+    header = None
+    moves = []
+    while position < len(data):
+        magic, version, kind, flags = struct.unpack_from('<4sBBB', data, position)
+        if magic != MOVES_MAGIC or version != MOVES_VERSION:
+            raise ValueError("{0} is not a version {1} moves file".format(file_name, MOVES_VERSION))
+        if kind == LAYER_RECORD:
+            if header is not None:
+                yield _move_layer(header, moves)
+            header = _LAYER_RECORD.unpack_from(data, position)
+            moves = []
+            position += _LAYER_RECORD.size
+            continue
+        count = _MOVES_RECORD.unpack_from(data, position)[4]
+        position += _MOVES_RECORD.size
+        column_type = np.uint32 if flags & WIDE_COLUMNS else np.uint16
+        record = []
+        for dtype in [np.uint32, column_type, column_type, np.uint8] + ([np.uint8] if flags & LEVELS else []):
+            values, position = _read_array(data, position, dtype, count)
+            record.append(values)
+        moves.append(record)
+    if header is not None:
+        yield _move_layer(header, moves)
+
+
+def _move_layer(header, moves):
+    _, _, _, flags, width, height, layer_height, laser_width, level_count = header
+    columns = [np.concatenate([record[index] for record in moves]) if moves else np.zeros(0, dtype=np.uint32) for index in range(4)]
+    leveled = [record for record in moves if len(record) == 5]
+    levels = np.concatenate([record[4] for record in leveled]) if leveled else None
+    rows, firsts, lasts, joined = columns
+    return MoveLayer(width, height, layer_height, laser_width, bool(flags & TRANSPOSED), rows, firsts.astype(np.int64), lasts.astype(np.int64), joined.astype(bool), levels,
+                     level_count=level_count, modulation='feed' if flags & FEED else 'power')
+
+
+def _read_array(data, position, dtype, count):
+    size = np.dtype(dtype).itemsize * count
+    values = data[position:position + size].view(dtype)
+    return values, position + size + _padding(size)
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _compact(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu' and values.dtype.itemsize <= 4:
+        return values
+    return values.astype(np.int32)
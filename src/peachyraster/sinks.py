@@ -0,0 +1,53 @@
+import gzip
+import lzma
+import os.path
+
+GZIP_LEVEL = 6
+LZMA_PRESET = 6
+# Compression used when none is asked for, by output file extension
+SUFFIXES = {'.gz': 'gzip', '.xz': 'lzma'}
+COMPRESSIONS = ['none', 'gzip', 'lzma']
+
+
+class OutputSink(object):
+    '''Streams gcode text or binary moves to a file, compressed with gzip or lzma if asked.
+
+    Text chunks are written as ASCII. The bytes handed to the sink are counted so the
+    compression ratio can be reported once it is closed.'''
+
+    def __init__(self, file_name, compression=None):
+        if compression is None:
+            compression = SUFFIXES.get(os.path.splitext(file_name)[1].lower(), 'none')
+        if compression not in COMPRESSIONS:
+            raise ValueError("Compression must be one of {0}".format(', '.join(COMPRESSIONS)))
+        self.file_name = file_name
+        self.compression = compression
+        self.bytes = 0
+        self.file = _open(file_name, compression)
+
+    def write(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('ascii')
+        self.bytes += len(chunk)
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def report(self):
+        size = os.path.getsize(self.file_name)
+        return "Output: {0} bytes written as {1} bytes ({2}, {3:.1f}x)".format(self.bytes, size, self.compression, float(self.bytes) / size if size else 1.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def _open(file_name, compression):
+    if compression == 'gzip':
+        return gzip.open(file_name, 'wb', GZIP_LEVEL)
+    if compression == 'lzma':
+        return lzma.open(file_name, 'wb', preset=LZMA_PRESET)
+    return open(file_name, 'wb')
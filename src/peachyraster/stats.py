@@ -0,0 +1,98 @@
+import numpy as np
+from .pathing import path_travel
+
+PREVIEW_SIZE = 512
+# Assumed speeds in mm/s for the time estimate, cuts at F1 and G0 travel
+CUT_SPEED = 10.0
+TRAVEL_SPEED = 100.0
+
+
+class PrintStats(object):
+    '''Totals for a print worked out from its runs without formatting any gcode.
+
+    Lengths are in mm, extrusion is the E value the gcode would end on, and the preview is a
+    top down view of every layer shrunk to at most PREVIEW_SIZE pixels a side.'''
+
+    def __init__(self, laser_width, cut_speed=CUT_SPEED, travel_speed=TRAVEL_SPEED):
+        self.laser_width = laser_width
+        self.cut_speed = cut_speed
+        self.travel_speed = travel_speed
+        self.layers = 0
+        self.width = 0.0
+        self.height = 0.0
+        self.extrusion = 0.0
+        self.moves = 0
+        self.cut = 0.0
+        self.travel = 0.0
+        self.seconds = 0.0
+        self.preview = None
+        self.scale = None
+
+    def add(self, layer, order, forward, feeds=None):
+        '''Adds a layer whose runs are cut in order, in the directions given, at feeds times the cut speed.'''
+        width, height = (layer.height, layer.width) if layer.transposed else (layer.width, layer.height)
+        lengths = (layer.ends.astype(np.int64) - layer.starts) - 1
+        cut = lengths * self.laser_width
+        travel = path_travel(layer.rows, layer.starts, layer.ends, order, forward) * self.laser_width
+        self.layers += 1
+        self.width = max(self.width, width * self.laser_width)
+        self.height = max(self.height, height * self.laser_width)
+        self.extrusion += layer.extrusion()
+        self.moves += len(layer)
+        self.cut += float(np.sum(cut))
+        self.travel += travel
+        speeds = self.cut_speed if feeds is None else self.cut_speed * feeds
+        self.seconds += float(np.sum(cut / speeds)) + travel / self.travel_speed
+        self._add_preview(layer, width, height)
+
+    def report(self):
+        minutes, seconds = divmod(int(round(self.seconds)), 60)
+        hours, minutes = divmod(minutes, 60)
+        return "\n".join([
+            "Layers: {0}".format(self.layers),
+            "Final Image Dimensions: width: {0}mm height: {1}mm".format(self.width, self.height),
+            "Extrusion: {:.2f}".format(self.extrusion),
+            "Moves: {0}, cut {1:.2f}mm, travel {2:.2f}mm".format(self.moves, self.cut, self.travel),
+            "Estimated Time: {0}:{1:02d}:{2:02d} at {3}mm/s cutting and {4}mm/s travel".format(hours, minutes, seconds, self.cut_speed, self.travel_speed),
+        ])
+
+    def save_preview(self, file_name):
+        from PIL import Image
+        preview = np.zeros((1, 1)) if self.preview is None else self.preview
+        Image.fromarray((255 - np.round(preview * 255)).astype(np.uint8), 'L').save(file_name, format='PNG')
+
+    def _add_preview(self, layer, width, height):
+        # The scale is set by the first layer so every layer lands on the same preview pixels
+        if self.scale is None:
+            self.scale = max(1, -(-max(width, height) // PREVIEW_SIZE))
+        coverage = self._coverage(layer)
+        if layer.transposed:
+            coverage = coverage.T
+        if self.preview is None:
+            self.preview = coverage
+            return
+        shape = np.maximum(self.preview.shape, coverage.shape)
+        self.preview = _centered(self.preview, shape)
+        self.preview = np.maximum(self.preview, _centered(coverage, shape))
+
+    def _coverage(self, layer):
+        # Run edges are marked along each preview row, summed into columns, then binned into preview columns
+        scale = self.scale
+        rows = -(-layer.height // scale)
+        columns = -(-layer.width // scale)
+        edges = np.zeros((rows, columns * scale + 1), dtype=np.int64)
+        preview_rows = layer.rows.astype(np.intp) // scale
+        np.add.at(edges, (preview_rows, layer.starts.astype(np.intp)), 1)
+        np.add.at(edges, (preview_rows, layer.ends.astype(np.intp)), -1)
+        covered = np.cumsum(edges[:, :-1], axis=1)
+        return covered.reshape(rows, columns, scale).sum(axis=2) / float(scale * scale)
+
+
+def _centered(preview, shape):
+    if tuple(preview.shape) == tuple(shape):
+        return preview
+    top = (shape[0] - preview.shape[0]) // 2
+    left = (shape[1] - preview.shape[1]) // 2
+    padded = np.zeros(shape, dtype=preview.dtype)
+    padded[top:top + preview.shape[0], left:left + preview.shape[1]] = preview
+    return padded
@@ -0,0 +1,96 @@
+import json
+from timeit import default_timer
+
+STAGES = ['decode', 'border', 'scan', 'plan', 'format', 'write']
+COUNTERS = ['pixels', 'runs', 'g0_moves', 'g1_moves', 'bytes', 'reused_rows']
+
+
+class Profiler(object):
+    '''Collects per layer stage timings and counters.
+
+    Stages are timed around whole bands and chunks, never per pixel, so a profiler can stay
+    enabled in production. A disabled profiler hands out a shared no-op stage.'''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.layers = []
+        self.layer = None
+
+    def start_layer(self, name):
+        if self.enabled:
+            self.layer = new_record(name)
+            self.layers.append(self.layer)
+
+    def stage(self, name, layer=None):
+        '''Times a block into the current layer, or into layer when it is given.'''
+        if layer is None:
+            layer = self.layer
+        if layer is None:
+            return _NULL_STAGE
+        return _Stage(layer['seconds'], name)
+
+    def count(self, name, amount):
+        if self.layer is not None:
+            self.layer[name] += amount
+
+    def merge(self, record):
+        '''Adds a record collected elsewhere, such as in a worker process, to the current layer.'''
+        if self.layer is not None and record is not None:
+            _add(self.layer, record)
+
+    def summary(self):
+        total = new_record('total')
+        for layer in self.layers:
+            _add(total, layer)
+        for record in self.layers + [total]:
+            seconds = sum(record['seconds'].values())
+            record['pixels_per_second'] = record['pixels'] / seconds if seconds else 0.0
+        return {'layers': self.layers, 'total': total}
+
+    def write(self, file_name):
+        with open(file_name, 'w') as profile_file:
+            json.dump(self.summary(), profile_file, indent=2, sort_keys=True)
+
+    def report(self):
+        total = self.summary()['total']
+        timings = ', '.join('{} {:.2f}s'.format(stage, total['seconds'][stage]) for stage in STAGES)
+        return "Profile: {}; {} runs, {} G0, {} G1, {} bytes, {:.0f} pixels/second".format(
+            timings, total['runs'], total['g0_moves'], total['g1_moves'], total['bytes'], total['pixels_per_second'])
+
+
+def new_record(name):
+    record = dict((counter, 0) for counter in COUNTERS)
+    record['layer'] = name
+    record['seconds'] = dict((stage, 0.0) for stage in STAGES)
+    return record
+
+
+def _add(record, other):
+    for counter in COUNTERS:
+        record[counter] += other[counter]
+    for stage in STAGES:
+        record['seconds'][stage] += other['seconds'][stage]
+
+
+class _Stage(object):
+    def __init__(self, seconds, name):
+        self.seconds = seconds
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+
+    def __exit__(self, *exception):
+        self.seconds[self.name] += default_timer() - self.start
+
+
+class _NullStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exception):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+DISABLED = Profiler(enabled=False)
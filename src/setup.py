@@ -13,6 +13,7 @@ setup(
     author="Peachy Printer",
     author_email="software+gcoderaster@peachyprinter.com",
     package_data={},
+    python_requires='>=3',
     install_requires=['numpy', 'pillow'],
     packages=find_packages(),
     py_modules=['VERSION'],
@@ -0,0 +1,82 @@
+import unittest
+import logging
+import os
+import sys
+import shutil
+import tempfile
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.cache import RunCache
+from peachyraster.raster import Raster, ImageRaster
+
+
+class RunCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_folder = os.path.join(self.folder, 'cache')
+        self.images = os.path.join(self.folder, 'images')
+        os.makedirs(self.images)
+        random = np.random.RandomState(13)
+        for index in range(4):
+            self.save_layer(index, random)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def save_layer(self, index, random):
+        image = np.ones((8, 9, 3), dtype=np.uint8) * 255
+        image[random.rand(8, 9) > 0.5] = [0, 0, 0]
+        Image.fromarray(image).save(os.path.join(self.images, '{:03d}.png'.format(index)))
+
+    def rastered_folder(self, cache, jobs=1):
+        output_file_name = os.path.join(self.folder, 'out.gcode')
+        Raster(0.1, 1, output_file_name, 0.1, back_and_forth=True, jobs=jobs, cache=cache).process_folder(self.images)
+        with open(output_file_name) as output_file:
+            return output_file.read()
+
+    def test_get_should_return_stored_runs(self):
+        cache = RunCache(self.cache_folder)
+        file_name = os.path.join(self.images, '000.png')
+        layer = ImageRaster(1, 1).find_runs(np.array(Image.open(file_name)))
+        key = cache.key(file_name, 1, 0, False)
+        self.assertEqual(None, cache.get(key))
+        cache.put(key, layer)
+        cached = cache.get(key)
+        self.assertEqual((layer.width, layer.height), (cached.width, cached.height))
+        self.assertEqual(layer.rows.tolist(), cached.rows.tolist())
+        self.assertEqual(layer.starts.tolist(), cached.starts.tolist())
+        self.assertEqual(layer.ends.tolist(), cached.ends.tolist())
+
+    def test_key_should_change_with_settings(self):
+        cache = RunCache(self.cache_folder)
+        file_name = os.path.join(self.images, '000.png')
+        self.assertNotEqual(cache.key(file_name, 1, 0, False), cache.key(file_name, 2, 0, False))
+
+    def test_process_folder_should_only_rescan_changed_layers(self):
+        expected = self.rastered_folder(None)
+        self.assertEqual(expected, self.rastered_folder(RunCache(self.cache_folder)))
+
+        self.save_layer(2, np.random.RandomState(99))
+        expected = self.rastered_folder(None)
+        cache = RunCache(self.cache_folder)
+        self.assertEqual(expected, self.rastered_folder(cache, jobs=2))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_evict_should_remove_least_recently_used_entries(self):
+        self.rastered_folder(RunCache(self.cache_folder))
+        entries = sorted(os.listdir(self.cache_folder))
+        for age, name in enumerate(entries):
+            os.utime(os.path.join(self.cache_folder, name), (1000 + age, 1000 + age))
+        size = os.path.getsize(os.path.join(self.cache_folder, entries[-1]))
+        cache = RunCache(self.cache_folder, max_bytes=size)
+        cache.evict()
+        self.assertEqual([entries[-1]], os.listdir(self.cache_folder))
+        self.assertEqual(3, cache.evicted)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
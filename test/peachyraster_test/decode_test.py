@@ -0,0 +1,193 @@
+import unittest
+import logging
+import os
+import sys
+import shutil
+import tempfile
+import tracemalloc
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.decode import load_mask, image_to_mask, open_strips, PackedMask, StripMask, _RawTiles
+from peachyraster.raster import Raster, ImageRaster
+
+
+class ReadRecorder(object):
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.shape = pixels.shape
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(self.pixels[key].shape)
+        return self.pixels[key]
+
+
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_image_to_mask_should_match_exact_black_for_rgb(self):
+        image = np.array([[[0, 0, 0], [255, 255, 255]],
+                          [[0, 0, 0], [10, 10, 10]]], dtype=np.uint8)
+        expected = np.array([[True, False], [True, False]])
+        self.assertTrue(np.array_equal(expected, image_to_mask(Image.fromarray(image))))
+
+    def test_image_to_mask_should_find_black_in_rgba_images(self):
+        image = np.array([[[0, 0, 0, 255], [255, 255, 255, 255]]], dtype=np.uint8)
+        self.assertTrue(np.array_equal([[True, False]], image_to_mask(Image.fromarray(image, 'RGBA'))))
+
+    def test_image_to_mask_should_not_match_near_black_without_threshold(self):
+        image = np.array([[[0, 0, 0], [1, 0, 0], [0, 0, 4]]], dtype=np.uint8)
+        self.assertTrue(np.array_equal([[True, False, False]], image_to_mask(Image.fromarray(image))))
+        self.assertTrue(np.array_equal([[True, True, True]], image_to_mask(Image.fromarray(image), 1)))
+
+    def test_image_to_mask_should_match_exact_black_in_palette_and_cmyk_images(self):
+        image = np.array([[[0, 0, 0], [1, 0, 0], [255, 255, 255], [0, 0, 3]]], dtype=np.uint8)
+        expected = [[True, False, False, False]]
+        self.assertTrue(np.array_equal(expected, image_to_mask(Image.fromarray(image).convert('P', palette=Image.ADAPTIVE))))
+        self.assertTrue(np.array_equal(expected, image_to_mask(Image.fromarray(image).convert('CMYK'))))
+
+    def test_image_to_mask_should_not_hold_every_band_at_once(self):
+        image = Image.fromarray((np.random.RandomState(6).rand(300, 400, 3) * 2).astype(np.uint8))
+        tracemalloc.start()
+        try:
+            mask = image_to_mask(image)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertTrue(np.array_equal(np.all(np.asarray(image) == 0, axis=2), mask))
+        self.assertLess(peak, 300 * 400 * 5)
+
+    def test_image_to_mask_should_treat_transparent_pixels_as_white(self):
+        image = np.array([[[0, 0, 0, 0], [255, 255, 255, 255], [0, 0, 0, 255], [0, 0, 0, 128]]], dtype=np.uint8)
+        self.assertTrue(np.array_equal([[False, False, True, False]], image_to_mask(Image.fromarray(image, 'RGBA'))))
+        self.assertTrue(np.array_equal([[False, False, True, True]], image_to_mask(Image.fromarray(image, 'RGBA'), 128)))
+        self.assertTrue(np.array_equal([[255, 255, 0, 127]], image_to_mask(Image.fromarray(image, 'RGBA'), None)))
+
+    def test_mapped_transparent_pixels_should_match_decoded(self):
+        image = (np.random.RandomState(4).rand(9, 11, 4) * 255).astype(np.uint8)
+        image[::2, :, :3] = 0
+        image[:, ::3, 3] = 0
+        image[1::2, :, 3] = 255
+        file_name = os.path.join(self.folder, 'layer.tif')
+        Image.fromarray(image, 'RGBA').save(file_name)
+        for threshold in [0, 120, None]:
+            strips = open_strips(file_name, threshold)
+            self.assertTrue(isinstance(strips.pixels, _RawTiles))
+            self.assertTrue(np.array_equal(image_to_mask(Image.fromarray(image, 'RGBA'), threshold), strips[0:9]))
+
+    def test_image_to_mask_should_use_threshold(self):
+        image = np.array([[0, 99, 100, 101, 255]], dtype=np.uint8)
+        self.assertTrue(np.array_equal([[True, True, True, False, False]], image_to_mask(Image.fromarray(image), 100)))
+
+    def test_image_to_mask_should_read_one_bit_images(self):
+        image = Image.fromarray(np.array([[0, 255, 0]], dtype=np.uint8)).convert('1')
+        self.assertTrue(np.array_equal([[True, False, True]], image_to_mask(image)))
+
+    def test_image_to_mask_without_threshold_should_return_luminance(self):
+        image = np.array([[[0, 0, 0], [255, 255, 255], [100, 150, 200]]], dtype=np.uint8)
+        expected = np.asarray(Image.fromarray(image).convert('L'))
+        self.assertTrue(np.array_equal(expected, image_to_mask(Image.fromarray(image), None)))
+
+    def test_packed_mask_should_unpack_row_bands(self):
+        mask = np.random.RandomState(3).rand(7, 13) > 0.5
+        packed = PackedMask(mask)
+        self.assertEqual((7, 13), packed.shape)
+        self.assertTrue(np.array_equal(mask[2:5], packed[2:5]))
+
+    def test_load_mask_should_raise_when_file_does_not_exist(self):
+        with self.assertRaises(IOError):
+            load_mask(os.path.join(self.folder, 'missing.png'))
+
+    def test_rastered_mask_should_match_rastered_image(self):
+        image = np.ones((9, 10, 3), dtype=np.uint8) * 255
+        image[np.random.RandomState(5).rand(9, 10) > 0.5] = [0, 0, 0]
+        file_name = os.path.join(self.folder, 'layer.png')
+        Image.fromarray(image).save(file_name)
+        expected = ImageRaster(0.1, 1).process(image)
+        self.assertEqual(expected, ImageRaster(0.1, 1).process(load_mask(file_name)))
+        self.assertEqual(expected, ImageRaster(0.1, 1, rows_per_chunk=4).process(load_mask(file_name, packed=True)))
+
+
+    def test_open_strips_should_match_load_mask(self):
+        image = (np.random.RandomState(9).rand(21, 13, 3) * 255).astype(np.uint8)
+        image[image[:, :, 0] < 100] = [0, 0, 0]
+        for extension in ['tif', 'ppm', 'bmp', 'png']:
+            for pixels in [image, image[:, :, 1]]:
+                file_name = os.path.join(self.folder, 'layer.' + extension)
+                Image.fromarray(pixels).save(file_name)
+                for threshold in [0, 120, None]:
+                    strips = open_strips(file_name, threshold)
+                    bands = np.concatenate([strips[0:5], strips[5:17], strips[17:30]])
+                    self.assertEqual((21, 13), strips.shape)
+                    self.assertTrue(np.array_equal(load_mask(file_name, threshold), bands), extension)
+
+    def test_open_strips_should_memory_map_uncompressed_images(self):
+        file_name = os.path.join(self.folder, 'layer.tif')
+        Image.fromarray(np.zeros((4, 4, 3), dtype=np.uint8)).save(file_name)
+        self.assertTrue(isinstance(open_strips(file_name).pixels, _RawTiles))
+
+    def test_open_strips_should_memory_map_npy_files(self):
+        pixels = np.array([[0, 200], [255, 10]], dtype=np.uint8)
+        file_name = os.path.join(self.folder, 'layer.npy')
+        np.save(file_name, pixels)
+        strips = open_strips(file_name, 10)
+        self.assertTrue(isinstance(strips.pixels, np.memmap))
+        self.assertTrue(np.array_equal([[True, False], [False, True]], strips[0:2]))
+        self.assertTrue(np.array_equal([[True, False], [False, True]], load_mask(file_name, 10)))
+
+    def test_raw_tiles_should_join_rows_across_tiles(self):
+        pixels = np.arange(30).reshape(10, 3)
+        tiles = _RawTiles([(0, pixels[0:4]), (4, pixels[4:8]), (8, pixels[8:10])], (10, 3))
+        self.assertTrue(np.array_equal(pixels[2:9], tiles[2:9]))
+        self.assertTrue(np.array_equal(pixels[5:7], tiles[5:7]))
+        self.assertTrue(np.array_equal(pixels[7:20], tiles[7:20]))
+
+    def test_column_major_strips_should_read_a_band_of_columns_at_a_time(self):
+        image = np.ones((23, 30, 3), dtype=np.uint8) * 255
+        image[np.random.RandomState(12).rand(23, 30) > 0.5] = [0, 0, 0]
+        mask = np.all(image == 0, axis=2)
+        expected = ImageRaster(0.1, 1, back_and_forth=True, column_major=True).process(image)
+        pixels = ReadRecorder(image)
+        self.assertEqual(expected, ImageRaster(0.1, 1, back_and_forth=True, column_major=True, rows_per_chunk=7).process(StripMask(pixels)))
+        self.assertEqual(5, len(pixels.reads))
+        self.assertTrue(all(shape[:2] == (23, min(7, 30 - 7 * index)) for index, shape in enumerate(pixels.reads)), pixels.reads)
+        self.assertEqual(expected, ImageRaster(0.1, 1, back_and_forth=True, column_major=True, rows_per_chunk=7).process(PackedMask(mask)))
+
+    def test_packed_mask_should_unpack_column_bands(self):
+        mask = np.random.RandomState(13).rand(5, 29) > 0.5
+        packed = PackedMask(mask)
+        for first, last in [(0, 29), (3, 11), (8, 16), (13, 14), (20, 40), (7, 7)]:
+            self.assertTrue(np.array_equal(mask[:, first:last], packed.columns(slice(first, last))), (first, last))
+
+    def test_raw_tiles_should_slice_columns(self):
+        pixels = np.arange(60).reshape(10, 6)
+        tiles = _RawTiles([(0, pixels[0:4]), (4, pixels[4:10])], (10, 6))
+        self.assertTrue(np.array_equal(pixels[:, 2:5], tiles[:, 2:5]))
+
+    def test_strip_mode_should_match_whole_image_output(self):
+        image = np.ones((30, 17, 3), dtype=np.uint8) * 255
+        image[np.random.RandomState(10).rand(30, 17) > 0.5] = [0, 0, 0]
+        file_name = os.path.join(self.folder, 'layer.bmp')
+        Image.fromarray(image).save(file_name)
+        expected_file_name = os.path.join(self.folder, 'expected.gcode')
+        output_file_name = os.path.join(self.folder, 'out.gcode')
+        Raster(0.1, 2, expected_file_name, back_and_forth=True).process_file(file_name)
+        Raster(0.1, 2, output_file_name, back_and_forth=True, strip_rows=7).process_file(file_name)
+        with open(expected_file_name) as expected_file, open(output_file_name) as output_file:
+            self.assertEqual(expected_file.read(), output_file.read())
+        Raster(0.1, 2, expected_file_name, back_and_forth=True, column_major=True).process_file(file_name)
+        Raster(0.1, 2, output_file_name, back_and_forth=True, column_major=True, strip_rows=7).process_file(file_name)
+        with open(expected_file_name) as expected_file, open(output_file_name) as output_file:
+            self.assertEqual(expected_file.read(), output_file.read())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
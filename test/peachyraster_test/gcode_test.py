@@ -0,0 +1,49 @@
+import unittest
+import logging
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.gcode import format_table, format_rows, choose_rows, table_to_text
+
+
+class GcodeTest(unittest.TestCase):
+    def assertFormatsLikePython(self, values):
+        expected = ''.join(["X{:.2f}\n".format(value) for value in values])
+        self.assertEqual(expected, format_table(["X", "\n"], [np.array(values, dtype=np.float64)]))
+
+    def test_format_table_should_match_str_format_for_random_values(self):
+        random = np.random.RandomState(21)
+        self.assertFormatsLikePython((random.randn(5000) * 1000).tolist())
+
+    def test_format_table_should_match_str_format_near_rounding_ties(self):
+        values = [0.005, 0.015, 0.125, 0.375, 2.675, 1.005, -0.125, -2.675, 123456789.125]
+        values += (np.arange(-200, 200) * 0.1 - 9.95).tolist()
+        values += (np.arange(-200, 200) * 0.005).tolist()
+        self.assertFormatsLikePython(values)
+
+    def test_format_table_should_keep_negative_zero(self):
+        self.assertFormatsLikePython([0.0, -0.0, -0.001, 0.004, -0.004])
+
+    def test_format_table_should_format_large_values(self):
+        self.assertFormatsLikePython([0.0, 9.995, 99999999.0, 1e12, 3.2e10 + 0.25])
+
+    def test_format_table_should_join_literals_and_columns(self):
+        result = format_table(["G1 F1 X", " Y", "\n"], [np.array([1.0, -2.5]), np.array([3.25, 10.0])])
+        self.assertEqual("G1 F1 X1.00 Y3.25\nG1 F1 X-2.50 Y10.00\n", result)
+
+    def test_format_table_should_return_empty_text_for_no_rows(self):
+        self.assertEqual('', format_table(["X", "\n"], [np.array([])]))
+
+    def test_choose_rows_should_mix_rows_of_different_widths(self):
+        long_rows = format_rows(["LONG ", "\n"], [np.array([100.0, 200.0, 300.0])])
+        short_rows = format_rows(["S", "\n"], [np.array([1.0, 2.0, 3.0])])
+        result = table_to_text(choose_rows(np.array([True, False, True]), long_rows, short_rows))
+        self.assertEqual("LONG 100.00\nS2.00\nLONG 300.00\n", result)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
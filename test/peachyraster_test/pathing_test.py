@@ -0,0 +1,90 @@
+import unittest
+import logging
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.pathing import plan_path, path_travel, merge_strokes
+from peachyraster.raster import ImageRaster
+
+
+class PathingTest(unittest.TestCase):
+    def sparse_runs(self):
+        random = np.random.RandomState(11)
+        mask = random.rand(40, 60) > 0.97
+        return ImageRaster(1, 0).find_runs(mask)
+
+    def test_path_travel_should_measure_between_runs(self):
+        rows = np.array([0, 0, 2])
+        starts = np.array([0, 5, 5])
+        ends = np.array([2, 7, 7])
+        self.assertEqual(4.0 + 2.0, path_travel(rows, starts, ends, np.arange(3), [True, True, False]))
+
+    def test_plan_path_should_visit_every_run_once(self):
+        layer = self.sparse_runs()
+        order, forward = plan_path(layer.rows, layer.starts, layer.ends)
+        self.assertEqual(sorted(order.tolist()), list(range(len(layer))))
+        self.assertEqual(len(layer), len(forward))
+
+    def test_plan_path_should_reduce_travel(self):
+        layer = self.sparse_runs()
+        scan = path_travel(layer.rows, layer.starts, layer.ends, np.arange(len(layer)), np.ones(len(layer), dtype=bool))
+        greedy = path_travel(layer.rows, layer.starts, layer.ends, *plan_path(layer.rows, layer.starts, layer.ends, 0))
+        optimized = path_travel(layer.rows, layer.starts, layer.ends, *plan_path(layer.rows, layer.starts, layer.ends))
+        self.assertLess(greedy, scan)
+        self.assertLessEqual(optimized, greedy)
+
+    def test_plan_path_should_stop_when_a_pass_finds_no_better_move(self):
+        rows = np.arange(10)
+        starts = np.zeros(10, dtype=np.int64)
+        order, forward = plan_path(rows, starts, starts + 1, 10 ** 12)
+        self.assertEqual(list(range(10)), order.tolist())
+
+    def test_plan_path_should_handle_no_runs(self):
+        empty = np.array([], dtype=np.int32)
+        order, forward = plan_path(empty, empty, empty)
+        self.assertEqual(0, len(order))
+
+    def test_plan_path_should_not_lengthen_travel_with_more_budget(self):
+        mask = np.random.RandomState(7).rand(60, 80) > 0.5
+        layer = ImageRaster(1, 0).find_runs(mask)
+        travels = [path_travel(layer.rows, layer.starts, layer.ends, *plan_path(layer.rows, layer.starts, layer.ends, budget)) for budget in [0, 4, 16, 1000]]
+        self.assertEqual(sorted(travels, reverse=True), travels)
+
+    def test_plan_path_should_cut_runs_backwards_when_nearer(self):
+        rows = np.array([0, 1])
+        starts = np.array([0, 0])
+        ends = np.array([5, 5])
+        order, forward = plan_path(rows, starts, ends)
+        self.assertEqual([0, 1], order.tolist())
+        self.assertEqual([True, False], forward.tolist())
+
+    def test_merge_strokes_should_chain_identical_runs_in_consecutive_rows(self):
+        rows = np.array([0, 0, 1, 1, 2, 4])
+        starts = np.array([0, 5, 0, 6, 0, 0])
+        ends = np.array([3, 8, 3, 8, 3, 3])
+        order, forward, stroke_starts = merge_strokes(rows, starts, ends, 10)
+        self.assertEqual([0, 2, 4, 1, 3, 5], order.tolist())
+        self.assertEqual([True, False, True, True, True, True], forward.tolist())
+        self.assertEqual([True, False, False, True, True, True], stroke_starts.tolist())
+
+    def test_merge_strokes_should_handle_no_runs(self):
+        empty = np.array([], dtype=np.int32)
+        order, forward, stroke_starts = merge_strokes(empty, empty, empty, 10)
+        self.assertEqual(0, len(order))
+
+    def test_optimized_gcode_should_extrude_the_same_total(self):
+        mask = np.random.RandomState(2).rand(20, 30) > 0.8
+        expected = ImageRaster(1, 1)
+        expected.process(mask)
+        optimized = ImageRaster(1, 1, optimize_travel=True)
+        gcode = optimized.process(mask)
+        self.assertEqual(expected.extrude, optimized.extrude)
+        self.assertEqual(len(expected.find_runs(mask)) * 2 + 1, len(gcode.splitlines()))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
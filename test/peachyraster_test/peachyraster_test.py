@@ -0,0 +1,60 @@
+import unittest
+import logging
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from PIL import Image
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(__file__), '..', '..', 'src')
+sys.path.insert(0, SRC)
+
+
+def run_python(*args):
+    environment = dict(os.environ, PYTHONPATH=os.path.abspath(SRC))
+    return subprocess.run([sys.executable] + list(args), env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def run_cli(*args):
+    return run_python('-m', 'peachyraster.peachyraster', *args)
+
+
+class RunTest(unittest.TestCase):
+    def test_import_should_not_load_numpy_or_pil(self):
+        code = "import sys, peachyraster.peachyraster; print(sorted(set(['numpy', 'PIL']) & set(sys.modules)))"
+        result = run_python('-c', code)
+        self.assertEqual('[]', result.stdout.strip())
+
+    def test_help_should_exit_cleanly(self):
+        result = run_cli('--help')
+        self.assertEqual(0, result.returncode)
+        self.assertTrue('--stats_only' in result.stdout)
+
+    def test_missing_action_should_be_a_usage_error(self):
+        result = run_cli()
+        self.assertEqual(2, result.returncode)
+        self.assertTrue('No action requested' in result.stderr)
+
+    def test_script_should_match_module_output(self):
+        folder = tempfile.mkdtemp()
+        try:
+            image_file_name = os.path.join(folder, 'layer.png')
+            Image.fromarray(np.random.RandomState(1).rand(6, 7) > 0.5).save(image_file_name)
+            outputs = [os.path.join(folder, name) for name in ['module.gcode', 'script.gcode']]
+            self.assertEqual(0, run_cli('-f', image_file_name, '-o', outputs[0]).returncode)
+            script = os.path.join(os.path.abspath(SRC), 'peachyraster', 'peachyraster.py')
+            environment = dict(os.environ)
+            environment.pop('PYTHONPATH', None)
+            result = subprocess.run([sys.executable, script, '-f', image_file_name, '-o', outputs[1]], env=environment, cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertEqual(0, result.returncode, result.stderr)
+            with open(outputs[0]) as module_output, open(outputs[1]) as script_output:
+                self.assertEqual(module_output.read(), script_output.read())
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.pipeline import Pipeline
+
+
+def slow_square(value):
+    time.sleep(0.001 * (value % 3))
+    return value * value
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError("three")
+    return value
+
+
+class PipelineTest(unittest.TestCase):
+    def test_decoded_should_keep_order(self):
+        pipeline = Pipeline(threads=3, depth=2)
+        self.assertEqual([value * value for value in range(20)], list(pipeline.decoded(range(20), slow_square)))
+
+    def test_decoded_should_raise_decode_errors_in_order(self):
+        results = []
+        with self.assertRaises(ValueError):
+            for value in Pipeline(threads=2).decoded(range(6), fail_on_three):
+                results.append(value)
+        self.assertEqual([0, 1, 2], results)
+
+    def test_writer_should_write_in_order(self):
+        written = []
+        with Pipeline(depth=1).writer() as write:
+            for value in range(50):
+                write(written.append, value)
+        self.assertEqual(list(range(50)), written)
+
+    def test_writer_should_raise_write_errors(self):
+        def broken(value):
+            raise IOError("disk full")
+        with self.assertRaises(IOError):
+            with Pipeline().writer() as write:
+                write(broken, 1)
+
+    def test_report_should_list_blocked_time(self):
+        pipeline = Pipeline()
+        list(pipeline.decoded(range(3), slow_square))
+        self.assertTrue(pipeline.report().startswith("Pipeline blocked: decode"))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -1,110 +1,176 @@
 import unittest
 import logging
-from mock import patch, mock_open, call
+from unittest.mock import patch, mock_open, call
 import os
 import os.path
 import sys
+import shutil
+import tempfile
 from PIL import Image
 import numpy as np
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
 
-from peachyraster.raster import Raster, ImageRaster
+from peachyraster.raster import Raster, ImageRaster, LayerDiff
+from peachyraster.timing import DISABLED
 
 @patch('peachyraster.raster.ImageRaster')
 class RasterTest(unittest.TestCase):
 
     def test_init_file_should_setup_image_raster_with_defaults(self, mockImageRaster):
         Raster()
-        mockImageRaster.assert_called_with(0.5, True, back_and_forth=False)
+        mockImageRaster.assert_called_with(0.5, True, back_and_forth=False, optimize_travel=False, merge_rows=False, column_major=False, profiler=DISABLED, levels=0, modulation='power', output_format='gcode')
 
     @patch.object(os.path, 'isfile')
-    @patch.object(Image, 'open')
-    def test_process_file_should_call_image_raster_when_file_exists(self, mock_imread, mock_isfile, mockImageRaster):
+    @patch('peachyraster.raster.load_mask')
+    def test_process_file_should_call_image_raster_when_file_exists(self, mock_load_mask, mock_isfile, mockImageRaster):
         mock_isfile.return_value = True
-        mock_imread.return_value = "SomeArray"
+        mock_load_mask.return_value = "SomeArray"
         mock_file_raster = mockImageRaster.return_value
-        with patch('peachyraster.raster.open', mock_open(), create=True):
+        with patch('peachyraster.sinks.open', mock_open(), create=True):
             rasterer = Raster()
             rasterer.process_file("test0.png")
-        mock_file_raster.process.assert_called_with('SomeArray', 0.0)
+        mock_file_raster.generate.assert_called_with('SomeArray', 0.0)
+        self.assertEqual(0, mock_file_raster.find_runs.call_count)
 
     @patch.object(os.path, 'isfile')
-    @patch.object(Image, 'open')
+    @patch('peachyraster.raster.load_mask')
     @patch.object(os, 'listdir')
-    def test_process_folder_should_call_image_raster_for_each_image_file(self, mock_list_dir, mock_imread, mock_isfile, mockImageRaster):
+    def test_process_folder_should_call_image_raster_for_each_image_file(self, mock_list_dir, mock_load_mask, mock_isfile, mockImageRaster):
         mock_isfile.return_value = True
-        mock_imread.return_value = "SomeArray"
+        mock_load_mask.return_value = "SomeArray"
         mock_list_dir.return_value = ['1.jpg', '2.png', "3.txt"]
         mock_file_raster = mockImageRaster.return_value
-        with patch('peachyraster.raster.open', mock_open(), create=True):
+        with patch('peachyraster.sinks.open', mock_open(), create=True):
             rasterer = Raster( layer_height=1.0)
             rasterer.process_folder("test")
-        self.assertEquals( [call(os.path.join('test','1.jpg')), call(os.path.join('test','2.png'))] , mock_imread.call_args_list)
-        self.assertEquals(2, mock_file_raster.process.call_count)
-        self.assertEquals(call("SomeArray", 0.0) , mock_file_raster.process.call_args_list[0])
-        self.assertEquals(call("SomeArray", 1.0) , mock_file_raster.process.call_args_list[1])
+        self.assertEqual( [call(os.path.join('test', '1.jpg'), 0, False), call(os.path.join('test', '2.png'), 0, False)] , mock_load_mask.call_args_list)
+        self.assertEqual(2, mock_file_raster.generate.call_count)
+        self.assertEqual(call("SomeArray", 0.0) , mock_file_raster.generate.call_args_list[0])
+        self.assertEqual(call("SomeArray", 1.0) , mock_file_raster.generate.call_args_list[1])
 
     @patch.object(os.path, 'isfile')
-    @patch.object(Image, 'open')
+    @patch('peachyraster.raster.load_mask')
     @patch.object(os, 'listdir')
-    def test_process_folder_should_sort_images(self, mock_list_dir, mock_imread, mock_isfile, mockImageRaster):
+    def test_process_folder_should_sort_images(self, mock_list_dir, mock_load_mask, mock_isfile, mockImageRaster):
         mock_isfile.return_value = True
-        mock_imread.return_value = "SomeArray"
+        mock_load_mask.return_value = "SomeArray"
         mock_list_dir.return_value = ['b.jpg', 'a.png', "d.jpeg"]
-        with patch('peachyraster.raster.open', mock_open(), create=True):
+        with patch('peachyraster.sinks.open', mock_open(), create=True):
             rasterer = Raster( layer_height=1.0)
             rasterer.process_folder("test")
-        self.assertEquals( [
-            call(os.path.join('test','a.png')), 
-            call(os.path.join('test','b.jpg')),
-            call(os.path.join('test','d.jpeg')),
-            ], mock_imread.call_args_list)
+        self.assertEqual( [
+            call(os.path.join('test', 'a.png'), 0, False), 
+            call(os.path.join('test', 'b.jpg'), 0, False),
+            call(os.path.join('test', 'd.jpeg'), 0, False),
+            ], mock_load_mask.call_args_list)
 
 
     @patch.object(os.path, 'isfile')
-    @patch.object(Image, 'open')
-    def test_process_file_should_write_output_to_file(self, mock_imread, mock_isfile, mockImageRaster):
+    @patch('peachyraster.raster.load_mask')
+    def test_process_file_should_write_output_to_file(self, mock_load_mask, mock_isfile, mockImageRaster):
         output_file = 'out.gcode'
-        output_data = "some_gcode"
+        output_data = ["some_", "gcode"]
         mock_isfile.return_value = True
-        mock_imread.return_value = "SomeArray"
+        mock_load_mask.return_value = "SomeArray"
         mock_file_raster = mockImageRaster.return_value
-        mock_file_raster.process.return_value = output_data
+        mock_file_raster.generate.return_value = output_data
         mocked_open = mock_open()
 
-        with patch('peachyraster.raster.open', mocked_open, create=True):
+        with patch('peachyraster.sinks.open', mocked_open, create=True):
             rasterer = Raster(output_file_name=output_file)
             rasterer.process_file("test0.png")
-            mocked_open.assert_called_with(output_file, 'w')
-            mocked_open.return_value.write.assert_called_with(output_data)
-        mock_file_raster.process.assert_called_with('SomeArray', 0.0)
+            mocked_open.assert_called_with(output_file, 'wb')
+            self.assertEqual([call(b"some_"), call(b"gcode")], mocked_open.return_value.write.call_args_list)
+        mock_file_raster.generate.assert_called_with('SomeArray', 0.0)
+        self.assertEqual(0, mock_file_raster.find_runs.call_count)
 
     @patch.object(os.path, 'isfile')
-    @patch.object(Image, 'open')
-    def test_process_file_should_write_output_to_file_if_no_name_provided(self, mock_imread, mock_isfile, mockImageRaster):
-        output_data = "some_gcode"
+    @patch('peachyraster.raster.load_mask')
+    def test_process_file_should_write_output_to_file_if_no_name_provided(self, mock_load_mask, mock_isfile, mockImageRaster):
+        output_data = ["some_", "gcode"]
         mock_isfile.return_value = True
-        mock_imread.return_value = "SomeArray"
+        mock_load_mask.return_value = "SomeArray"
         mock_file_raster = mockImageRaster.return_value
-        mock_file_raster.process.return_value = output_data
+        mock_file_raster.generate.return_value = output_data
         mocked_open = mock_open()
 
-        with patch('peachyraster.raster.open', mocked_open, create=True):
+        with patch('peachyraster.sinks.open', mocked_open, create=True):
             rasterer = Raster()
             rasterer.process_file("test0.png")
-            self.assertEquals('w', mocked_open.call_args[0][1])
+            self.assertEqual('wb', mocked_open.call_args[0][1])
             self.assertTrue(mocked_open.call_args[0][0].startswith('out'))
-            mocked_open.return_value.write.assert_called(output_data)
-        mock_file_raster.process.assert_called_with('SomeArray', 0.0)
+            self.assertEqual([call(b"some_"), call(b"gcode")], mocked_open.return_value.write.call_args_list)
+        mock_file_raster.generate.assert_called_with('SomeArray', 0.0)
+        self.assertEqual(0, mock_file_raster.find_runs.call_count)
 
     def test_process_file_should_not_call_file_raster_when_file_does_not_exists(self, mockImageRaster):
         mock_file_raster = mockImageRaster.return_value
-        with patch('peachyraster.raster.open', mock_open(), create=True):
+        with patch('peachyraster.sinks.open', mock_open(), create=True):
             rasterer = Raster()
             with self.assertRaises(IOError):
                 rasterer.process_file("test1.png")
-        self.assertEquals(0, mock_file_raster.process.call_count)
+        self.assertEqual(0, mock_file_raster.generate.call_count)
+
+    @patch('peachyraster.raster.load_mask')
+    def test_process_file_should_load_mask_with_threshold(self, mock_load_mask, mockImageRaster):
+        with patch('peachyraster.sinks.open', mock_open(), create=True):
+            rasterer = Raster(threshold=100, packed=True)
+            rasterer.process_file("test0.png")
+        mock_load_mask.assert_called_with("test0.png", 100, True)
+
+
+class RasterFolderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        random = np.random.RandomState(7)
+        for index in range(5):
+            image = np.ones((9 + index, 11, 3), dtype=np.uint8) * 255
+            image[random.rand(9 + index, 11) > 0.5] = [0, 0, 0]
+            image[random.rand(9 + index, 11) > 0.8] = [100, 150, 200]
+            Image.fromarray(image).save(os.path.join(self.folder, '{:03d}.png'.format(index)))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def rastered_folder(self, jobs, **settings):
+        output_file_name = os.path.join(self.folder, 'out{}.gcode'.format(jobs))
+        Raster(0.1, 2, output_file_name, 0.1, back_and_forth=True, jobs=jobs, **settings).process_folder(self.folder)
+        with open(output_file_name) as output_file:
+            return output_file.read()
+
+    def test_process_folder_with_jobs_should_match_serial_output(self):
+        expected = self.rastered_folder(1)
+        self.assertEqual(expected, self.rastered_folder(3))
+
+    def test_process_folder_with_io_threads_should_match_serial_output(self):
+        expected = self.rastered_folder(1)
+        self.assertEqual(expected, self.rastered_folder(1, io_threads=3))
+        self.assertEqual(expected, self.rastered_folder(1, io_threads=1, strip_rows=4))
+
+    def test_process_folder_with_diff_layers_should_match_serial_output(self):
+        expected = self.rastered_folder(1)
+        self.assertEqual(expected, self.rastered_folder(1, diff_layers=True))
+        self.assertEqual(expected, self.rastered_folder(2, diff_layers=True, io_threads=2, strip_rows=3))
+        expected = self.rastered_folder(1, levels=4, column_major=True)
+        self.assertEqual(expected, self.rastered_folder(1, levels=4, column_major=True, diff_layers=True))
+
+    def test_process_runs_should_cut_in_the_gray_levels_saved(self):
+        runs_file_name = os.path.join(self.folder, 'layers.runs')
+        expected = self.rastered_folder(1, levels=4, runs_file_name=runs_file_name)
+        output_file_name = os.path.join(self.folder, 'replayed.gcode')
+        for levels in [0, 4]:
+            Raster(0.1, 2, output_file_name, back_and_forth=True, levels=levels).process_runs(runs_file_name)
+            with open(output_file_name) as output_file:
+                self.assertEqual(expected, output_file.read())
+        with self.assertRaises(ValueError):
+            Raster(0.1, 2, output_file_name, back_and_forth=True, levels=8).process_runs(runs_file_name)
+
+    def test_process_folder_in_gray_levels_should_match_for_all_readers(self):
+        expected = self.rastered_folder(1, levels=8)
+        self.assertTrue(' S1.00' in expected)
+        self.assertEqual(expected, self.rastered_folder(2, levels=8))
+        self.assertEqual(expected, self.rastered_folder(1, levels=8, strip_rows=4))
 
 
 class ImageRasterTest(unittest.TestCase):
@@ -150,7 +216,7 @@ class ImageRasterTest(unittest.TestCase):
 
         IR = ImageRaster(laser_width, True)
         result = IR.process(image)
-        self.assertEquals(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
 
     def test_process_should_return_gcode_at_specified_height(self):
         laser_width = 1
@@ -184,7 +250,7 @@ class ImageRasterTest(unittest.TestCase):
 
         IR = ImageRaster(laser_width, True)
         result = IR.process(image, height)
-        self.assertEquals(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
 
     def test_process_should_return_gcode_with_no_borders(self):
         laser_width = 1
@@ -207,7 +273,7 @@ class ImageRasterTest(unittest.TestCase):
 
         IR = ImageRaster(laser_width, borders)
         result = IR.process(image, height)
-        self.assertEquals(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
 
     def test_process_should_return_gcode_with_specified_border(self):
         laser_width = 1
@@ -248,7 +314,7 @@ class ImageRasterTest(unittest.TestCase):
 
         IR = ImageRaster(laser_width, border)
         result = IR.process(image, height)
-        self.assertEquals(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
 
     def test_process_should_do_back_and_forth_rasters(self):
         laser_width = 1
@@ -286,7 +352,158 @@ class ImageRasterTest(unittest.TestCase):
 
         IR = ImageRaster(laser_width, True, back_and_forth=True)
         result = IR.process(image, height)
-        self.assertEquals(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_should_match_reference_for_random_images(self):
+        random = np.random.RandomState(42)
+        for back_and_forth in [False, True]:
+            for border in [0, 1, 3]:
+                image = (random.rand(13, 17, 3) > 0.4).astype(np.uint8) * 255
+                image[random.rand(13, 17) > 0.5] = [0, 0, 0]
+                expected_raster = ImageRaster(0.1, border, back_and_forth=back_and_forth, reference=True)
+                raster = ImageRaster(0.1, border, back_and_forth=back_and_forth, rows_per_chunk=5)
+                for height in [0.0, 0.1, 0.2]:
+                    expected = expected_raster.process(image, height)
+                    result = raster.process(image, height)
+                    self.assertEqual(expected, result, self.gcode_equal(expected, result))
+                self.assertEqual(expected_raster.extrude, raster.extrude)
+                self.assertEqual(expected_raster.is_forward, raster.is_forward)
+
+    def test_process_should_match_reference_for_empty_image(self):
+        image = np.ones((4, 5, 3), dtype=np.uint8) * 255
+        expected = ImageRaster(1, 0, back_and_forth=True, reference=True).process(image)
+        result = ImageRaster(1, 0, back_and_forth=True).process(image)
+        self.assertEqual("G1 Z0.00 F1\n", result)
+        self.assertEqual(expected, result)
+
+    def test_process_should_match_reference_without_border_for_rgba_image(self):
+        image = np.zeros((3, 4, 4), dtype=np.uint8)
+        for back_and_forth in [False, True]:
+            expected_raster = ImageRaster(1, 1, back_and_forth=back_and_forth, reference=True)
+            raster = ImageRaster(1, 1, back_and_forth=back_and_forth)
+            for height in [0.0, 0.1]:
+                expected = expected_raster.process(image, height)
+                self.assertEqual(expected, raster.process(image, height))
+            self.assertEqual("G1 Z0.10 F1\n", expected)
+            self.assertEqual(expected_raster.is_forward, raster.is_forward)
+            self.assertEqual(0, len(raster.find_runs(image)))
+
+    def test_generate_should_yield_the_layer_in_row_chunks(self):
+        image = np.ones((10, 4, 3), dtype=np.uint8) * 255
+        image[:, 1] = [0, 0, 0]
+        expected = ImageRaster(1, 1, back_and_forth=True).process(image)
+        chunks = list(ImageRaster(1, 1, back_and_forth=True, rows_per_chunk=3).generate(image))
+        self.assertEqual("G1 Z0.00 F1\n", chunks[0])
+        self.assertEqual(7, len(chunks))
+        self.assertEqual(expected, ''.join(chunks))
+
+    def test_process_should_merge_identical_runs_in_consecutive_rows(self):
+        mask = np.array([[False, True, True, False],
+                         [False, True, True, False],
+                         [True, True, True, False]])
+        expected_gcode = "".join([
+        "G1 Z0.00 F1\n",
+        "G0 F1 X-0.50 Y1.00 E0.00\n",
+        "G1 F1 X0.50 E2.00\n",
+        "G1 F1 Y0.00\n",
+        "G1 F1 X-0.50 E4.00\n",
+        "G0 F1 X-1.50 Y-1.00 E0.00\n",
+        "G1 F1 X0.50 E7.00\n",])
+
+        result = ImageRaster(1, 0, merge_rows=True).process(mask)
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_should_scan_columns_when_column_major(self):
+        mask = np.array([[False, True, True, False],
+                         [False, True, True, False],
+                         [True, True, True, False]])
+        expected_gcode = "".join([
+        "G1 Z0.00 F1\n",
+        "G0 F1 X-1.50 Y-1.00 E0.00\n",
+        "G1 F1 X-1.50 Y-1.00 E1.00\n",
+        "G0 F1 X-0.50 Y1.00 E0.00\n",
+        "G1 F1 X-0.50 Y-1.00 E4.00\n",
+        "G0 F1 X0.50 Y1.00 E0.00\n",
+        "G1 F1 X0.50 Y-1.00 E7.00\n",])
+
+        result = ImageRaster(1, 0, column_major=True).process(mask)
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_should_merge_columns_when_column_major(self):
+        mask = np.array([[False, True, True, False],
+                         [False, True, True, False],
+                         [True, True, True, False]])
+        expected_gcode = "".join([
+        "G1 Z0.00 F1\n",
+        "G0 F1 X-1.50 Y-1.00 E0.00\n",
+        "G1 F1 Y-1.00 E1.00\n",
+        "G0 F1 X-0.50 Y1.00 E0.00\n",
+        "G1 F1 Y-1.00 E4.00\n",
+        "G1 F1 X0.50\n",
+        "G1 F1 Y1.00 E7.00\n",])
+
+        result = ImageRaster(1, 0, merge_rows=True, column_major=True).process(mask)
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_should_emit_power_per_run_of_equal_gray_level(self):
+        image = np.array([[0, 0, 128, 128, 255, 40]], dtype=np.uint8)
+        expected_gcode = "".join([
+        "G1 Z0.00 F1\n",
+        "G0 F1 X-2.50 Y0.00 E0.00\n",
+        "G1 F1 X-1.50 Y0.00 E2.00 S1.00\n",
+        "G1 F1 X0.50 Y0.00 E4.00 S0.33\n",
+        "G0 F1 X2.50 Y0.00 E0.00\n",
+        "G1 F1 X2.50 Y0.00 E5.00 S1.00\n",])
+
+        result = ImageRaster(1, 0, levels=4).process(image)
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_should_slow_feed_for_darker_gray_levels(self):
+        image = np.array([[[0, 0, 0], [128, 128, 128]],
+                          [[128, 128, 128], [0, 0, 0]]], dtype=np.uint8)
+        expected_gcode = "".join([
+        "G1 Z0.00 F1\n",
+        "G0 F1 X-0.50 Y0.50 E0.00\n",
+        "G1 F1.00 X-0.50 Y0.50 E1.00\n",
+        "G1 F3.00 X0.50 Y0.50 E2.00\n",
+        "G0 F1 X0.50 Y-0.50 E0.00\n",
+        "G1 F1.00 X0.50 Y-0.50 E3.00\n",
+        "G1 F3.00 X-0.50 Y-0.50 E4.00\n",])
+
+        result = ImageRaster(1, 0, back_and_forth=True, levels=4, modulation='feed').process(image)
+        self.assertEqual(expected_gcode, result, self.gcode_equal(expected_gcode, result))
+
+    def test_process_with_two_gray_levels_should_match_black_and_white(self):
+        random = np.random.RandomState(8)
+        for border in [0, 2]:
+            mask = random.rand(10, 13) > 0.5
+            expected = ImageRaster(0.5, border, back_and_forth=True).process(mask)
+            result = ImageRaster(0.5, border, back_and_forth=True, levels=2).process(mask)
+            self.assertEqual(expected, result.replace(' S1.00', ''))
+            layer = ImageRaster(0.5, border, levels=2, rows_per_chunk=3).find_runs(mask)
+            self.assertEqual(ImageRaster(0.5, border).find_runs(mask).rows.tolist(), layer.rows.tolist())
+            self.assertEqual([1] * len(layer), layer.levels.tolist())
+
+    def test_find_runs_with_diff_should_only_rescan_changed_rows(self):
+        random = np.random.RandomState(12)
+        diff = LayerDiff()
+        mask = random.rand(20, 15) > 0.5
+        reused = []
+        for changes in [0, 3, 0, 20]:
+            mask = mask.copy()
+            mask[random.randint(0, 20, changes)] = random.rand(changes, 15) > 0.5
+            expected = ImageRaster(1, 1).find_runs(mask)
+            result = ImageRaster(1, 1, rows_per_chunk=6).find_runs(mask, diff)
+            self.assertEqual(expected.rows.tolist(), result.rows.tolist())
+            self.assertEqual(expected.starts.tolist(), result.starts.tolist())
+            self.assertEqual(expected.ends.tolist(), result.ends.tolist())
+            self.assertEqual(20, diff.rows)
+            reused.append(diff.reused)
+        self.assertEqual(0, reused[0])
+        self.assertTrue(17 <= reused[1] < 20)
+        self.assertEqual(20, reused[2])
+        diff.start((21, 15))
+        self.assertEqual(None, diff.values)
 
     def gcode_equal(self, one, two):
         result = '\n'
@@ -0,0 +1,143 @@
+import unittest
+import logging
+import os
+import sys
+import shutil
+import tempfile
+import gzip
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.runs import LayerRuns, read_layers, read_moves
+from peachyraster.raster import Raster, ImageRaster
+
+
+class LayerRunsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertLayerEquals(self, expected, result):
+        self.assertEqual((expected.width, expected.height, expected.transposed), (result.width, result.height, result.transposed))
+        self.assertEqual(expected.rows.tolist(), result.rows.tolist())
+        self.assertEqual(expected.starts.tolist(), result.starts.tolist())
+        self.assertEqual(expected.ends.tolist(), result.ends.tolist())
+        self.assertEqual(expected.levels is None, result.levels is None)
+        self.assertEqual(expected.level_count, result.level_count)
+        if expected.levels is not None:
+            self.assertEqual(expected.levels.tolist(), result.levels.tolist())
+
+    def test_read_layers_should_return_written_layers_and_heights(self):
+        mask = np.random.RandomState(4).rand(11, 7) > 0.5
+        layers = [
+            ImageRaster(1, 1).find_runs(mask),
+            ImageRaster(1, 0, column_major=True).find_runs(mask),
+            ImageRaster(1, 0).find_runs(np.zeros((3, 5), dtype=bool)),
+            LayerRuns(70000, 2, [0, 1], [5, 0], [69999, 70000]),
+            ImageRaster(1, 1, levels=16).find_runs(np.random.RandomState(5).randint(0, 256, (6, 9)).astype(np.uint8)),
+        ]
+        file_name = os.path.join(self.folder, 'layers.runs')
+        with open(file_name, 'wb') as runs_file:
+            for index, layer in enumerate(layers):
+                layer.write(runs_file, index * 0.1)
+        result = list(read_layers(file_name))
+        self.assertEqual(len(layers), len(result))
+        for index, (expected, (layer, height)) in enumerate(zip(layers, result)):
+            self.assertLayerEquals(expected, layer)
+            self.assertEqual(index * 0.1, height)
+
+    def test_load_should_return_saved_layer(self):
+        layer = ImageRaster(1, 2).find_runs(np.random.RandomState(6).rand(5, 9) > 0.5)
+        file_name = os.path.join(self.folder, 'layer.runs')
+        layer.save(file_name)
+        self.assertLayerEquals(layer, LayerRuns.load(file_name))
+
+    def test_read_layers_should_reject_other_files(self):
+        file_name = os.path.join(self.folder, 'layer.runs')
+        with open(file_name, 'wb') as runs_file:
+            runs_file.write(b'G1 Z0.00 F1\n' * 4)
+        with self.assertRaises(ValueError):
+            list(read_layers(file_name))
+
+    def test_process_runs_should_match_rastering_the_images(self):
+        images = os.path.join(self.folder, 'images')
+        os.makedirs(images)
+        random = np.random.RandomState(8)
+        for index in range(3):
+            image = np.ones((7, 12, 3), dtype=np.uint8) * 255
+            image[random.rand(7, 12) > 0.5] = [0, 0, 0]
+            Image.fromarray(image).save(os.path.join(images, '{:03d}.png'.format(index)))
+        runs_file_name = os.path.join(self.folder, 'layers.runs')
+        expected_file_name = os.path.join(self.folder, 'expected.gcode')
+        output_file_name = os.path.join(self.folder, 'out.gcode')
+
+        Raster(0.2, 1, expected_file_name, 0.5, back_and_forth=True, runs_file_name=runs_file_name).process_folder(images)
+        Raster(0.2, 1, output_file_name, back_and_forth=True).process_runs(runs_file_name)
+
+        with open(expected_file_name) as expected_file, open(output_file_name) as output_file:
+            self.assertEqual(expected_file.read(), output_file.read())
+
+
+
+class MovesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read_both(self, image, **settings):
+        file_name = os.path.join(self.folder, 'layer.moves')
+        with open(file_name, 'wb') as moves_file:
+            moves_file.write(ImageRaster(0.5, 1, output_format='moves', **settings).process(image, 0.3))
+        return ImageRaster(0.5, 1, **settings).process(image, 0.3), list(read_moves(file_name))
+
+    def test_moves_should_end_where_gcode_cuts_end(self):
+        image = (np.random.RandomState(2).rand(9, 14) * 255).astype(np.uint8)
+        gcode, layers = self.read_both(image, back_and_forth=True, levels=4)
+        self.assertEqual(1, len(layers))
+        layer = layers[0]
+        self.assertEqual((16, 11, 0.3, 0.5, False), (layer.width, layer.height, layer.layer_height, layer.laser_width, layer.transposed))
+        self.assertEqual((4, 'power'), (layer.level_count, layer.modulation))
+        cuts = [line.split() for line in gcode.splitlines() if line.startswith('G1 F1 X')]
+        x = layer.lasts * 0.5 - (layer.width - 1) * 0.5 / 2.0
+        y = (layer.height - layer.rows.astype(np.int64)) * 0.5 - (layer.height + 1) * 0.5 / 2.0
+        self.assertEqual([(cut[2], cut[3], cut[5]) for cut in cuts], [("X{:.2f}".format(a), "Y{:.2f}".format(b), "S{:.2f}".format(c / (layer.level_count - 1.0))) for a, b, c in zip(x, y, layer.levels)])
+        self.assertEqual(gcode.count('G0 '), int(np.count_nonzero(~layer.joined)))
+
+    def test_moves_should_join_merged_strokes(self):
+        mask = np.random.RandomState(3).rand(12, 10) > 0.4
+        gcode, layers = self.read_both(mask, merge_rows=True, column_major=True)
+        layer = layers[0]
+        self.assertTrue(layer.transposed)
+        self.assertEqual(len(ImageRaster(0.5, 1, column_major=True).find_runs(mask)), len(layer))
+        self.assertEqual(gcode.count('G0 '), int(np.count_nonzero(~layer.joined)))
+        self.assertEqual(None, layer.levels)
+        self.assertEqual(0, layer.level_count)
+
+    def test_moves_should_record_feed_modulation(self):
+        image = (np.random.RandomState(4).rand(7, 9) * 255).astype(np.uint8)
+        gcode, layers = self.read_both(image, levels=8, modulation='feed')
+        layer = layers[0]
+        self.assertEqual((8, 'feed'), (layer.level_count, layer.modulation))
+        cuts = [line.split() for line in gcode.splitlines() if line.startswith('G1 F') and ' X' in line]
+        self.assertEqual([cut[1] for cut in cuts], ["F{:.2f}".format((layer.level_count - 1.0) / c) for c in layer.levels])
+
+    def test_process_folder_should_write_compressed_moves(self):
+        for index in range(3):
+            Image.fromarray(np.random.RandomState(index).rand(8, 8) > 0.5).save(os.path.join(self.folder, '{:03d}.png'.format(index)))
+        output_file_name = os.path.join(self.folder, 'out.moves.gz')
+        Raster(0.5, 1, output_file_name, 0.2, output_format='moves').process_folder(self.folder)
+        moves_file_name = os.path.join(self.folder, 'out.moves')
+        with gzip.open(output_file_name, 'rb') as compressed, open(moves_file_name, 'wb') as moves_file:
+            moves_file.write(compressed.read())
+        self.assertEqual([0.0, 0.2, 0.4], [round(layer.layer_height, 6) for layer in read_moves(moves_file_name)])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import logging
+import os
+import sys
+import gzip
+import lzma
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.sinks import OutputSink
+
+
+class OutputSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def written(self, name, compression=None):
+        file_name = os.path.join(self.folder, name)
+        with OutputSink(file_name, compression) as sink:
+            sink.write("G1 Z0.00 F1\n" * 100)
+            sink.write(b"G0 F1 X1.00 Y1.00 E0.00\n")
+        self.assertEqual(1224, sink.bytes)
+        return file_name, sink
+
+    def test_sink_should_write_plain_text(self):
+        file_name, sink = self.written('out.gcode')
+        self.assertEqual('none', sink.compression)
+        with open(file_name, 'rb') as output_file:
+            self.assertEqual(b"G1 Z0.00 F1\n" * 100 + b"G0 F1 X1.00 Y1.00 E0.00\n", output_file.read())
+
+    def test_sink_should_compress_by_extension(self):
+        for name, opener, compression in [('out.gcode.gz', gzip.open, 'gzip'), ('out.gcode.xz', lzma.open, 'lzma')]:
+            file_name, sink = self.written(name)
+            self.assertEqual(compression, sink.compression)
+            with opener(file_name, 'rb') as output_file:
+                self.assertEqual(1224, len(output_file.read()))
+            self.assertTrue(os.path.getsize(file_name) < sink.bytes)
+            self.assertTrue(sink.report().startswith("Output: 1224 bytes written as"))
+
+    def test_sink_should_use_requested_compression(self):
+        file_name, sink = self.written('out.gcode', 'gzip')
+        with gzip.open(file_name, 'rb') as output_file:
+            self.assertEqual(1224, len(output_file.read()))
+
+    def test_sink_should_reject_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            OutputSink(os.path.join(self.folder, 'out.gcode'), 'zip')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import logging
+import os
+import sys
+import math
+import shutil
+import tempfile
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.raster import Raster, ImageRaster
+from peachyraster.stats import PrintStats
+
+
+def measure_gcode(gcode):
+    position = None
+    cut = travel = extrusion = 0.0
+    for line in gcode.splitlines():
+        words = dict((word[0], word[1:]) for word in line.split()[1:])
+        if 'X' not in words and 'Y' not in words:
+            continue
+        x = float(words.get('X', position[0] if position else 0))
+        y = float(words.get('Y', position[1] if position else 0))
+        if position is not None:
+            distance = math.hypot(x - position[0], y - position[1])
+            if line.startswith('G1') and 'E' in words:
+                cut += distance
+                extrusion = float(words['E'])
+            else:
+                travel += distance
+        position = (x, y)
+    return cut, travel, extrusion
+
+
+class PrintStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_stats_should_match_the_gcode(self):
+        random = np.random.RandomState(21)
+        masks = [random.rand(13, 17) > 0.5 for _ in range(3)]
+        for settings in [{}, {'back_and_forth': True}, {'merge_rows': True}, {'optimize_travel': True, 'column_major': True}]:
+            stats = PrintStats(0.5)
+            raster = ImageRaster(0.5, 1, **settings)
+            planner = ImageRaster(0.5, 1, **settings)
+            cut = travel = extrusion = 0.0
+            for mask in masks:
+                layer = raster.find_runs(mask)
+                layer_cut, layer_travel, extrusion = measure_gcode(''.join(raster.generate_runs(layer)))
+                cut += layer_cut
+                travel += layer_travel
+                stats.add(layer, *planner.plan(layer))
+            self.assertAlmostEqual(cut, stats.cut, 6, settings)
+            self.assertAlmostEqual(travel, stats.travel, 6, settings)
+            self.assertAlmostEqual(extrusion, stats.extrusion, 6)
+            self.assertEqual(raster.is_forward, planner.is_forward)
+            self.assertEqual(len(masks), stats.layers)
+            self.assertEqual((9.5, 7.5), (stats.width, stats.height))
+
+    def test_preview_should_show_covered_pixels(self):
+        mask = np.zeros((1200, 600), dtype=bool)
+        mask[:600, :300] = True
+        stats = PrintStats(0.1)
+        planner = ImageRaster(0.1, 0)
+        layer = planner.find_runs(mask)
+        stats.add(layer, *planner.plan(layer))
+        self.assertEqual(3, stats.scale)
+        self.assertEqual((400, 200), stats.preview.shape)
+        self.assertEqual(1.0, stats.preview[0, 0])
+        self.assertEqual(0.0, stats.preview[-1, -1])
+
+    def test_stats_only_should_write_preview_instead_of_gcode(self):
+        images = os.path.join(self.folder, 'images')
+        os.makedirs(images)
+        for index in range(2):
+            Image.fromarray(np.random.RandomState(index).rand(30, 40) > 0.5).save(os.path.join(images, '{:03d}.png'.format(index)))
+        preview_file_name = os.path.join(self.folder, 'preview.png')
+        raster = Raster(0.1, 1, preview_file_name, back_and_forth=True, stats_only=True)
+        raster.process_folder(images)
+        with Image.open(preview_file_name) as preview:
+            self.assertEqual((42, 32), preview.size)
+        output_file_name = os.path.join(self.folder, 'out.gcode')
+        Raster(0.1, 1, output_file_name, back_and_forth=True).process_folder(images)
+        with open(output_file_name) as output_file:
+            self.assertAlmostEqual(measure_gcode(output_file.read())[2], raster.stats.extrusion, 6)
+
+    def test_stats_only_should_write_png_whatever_the_output_name(self):
+        image_file_name = os.path.join(self.folder, 'layer.png')
+        Image.fromarray(np.random.RandomState(3).rand(10, 12) > 0.5).save(image_file_name)
+        preview_file_name = os.path.join(self.folder, 'preview.gcode')
+        Raster(0.1, 1, preview_file_name, stats_only=True).process_file(image_file_name)
+        with Image.open(preview_file_name) as preview:
+            self.assertEqual(('PNG', (14, 12)), (preview.format, preview.size))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import logging
+import os
+import sys
+import json
+import shutil
+import tempfile
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.timing import Profiler, DISABLED, STAGES
+from peachyraster.raster import Raster
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_disabled_profiler_records_nothing(self):
+        DISABLED.start_layer('a')
+        with DISABLED.stage('scan'):
+            pass
+        DISABLED.count('runs', 3)
+        self.assertEqual([], DISABLED.layers)
+
+    def test_summary_totals_layers(self):
+        profiler = Profiler()
+        for name in ['a', 'b']:
+            profiler.start_layer(name)
+            profiler.count('runs', 2)
+            with profiler.stage('scan'):
+                pass
+        total = profiler.summary()['total']
+        self.assertEqual(4, total['runs'])
+        self.assertEqual(sorted(STAGES), sorted(total['seconds'].keys()))
+
+
+class RasterProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        image = np.ones((6, 7, 3), dtype=np.uint8) * 255
+        image[1:3, 2:5] = 0
+        image[4, 1] = 0
+        for index in range(2):
+            Image.fromarray(image).save(os.path.join(self.folder, '{}.png'.format(index)))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_profile_counts_match_output(self):
+        for jobs, io_threads in [(1, 0), (2, 0), (1, 2)]:
+            output_file_name = os.path.join(self.folder, 'out.gcode')
+            profile_file_name = os.path.join(self.folder, 'profile.json')
+            Raster(output_file_name=output_file_name, jobs=jobs, io_threads=io_threads, profile_file_name=profile_file_name).process_folder(self.folder)
+            with open(output_file_name) as output_file:
+                gcode = output_file.read()
+            with open(profile_file_name) as profile_file:
+                profile = json.load(profile_file)
+            total = profile['total']
+            self.assertEqual(2, len(profile['layers']))
+            self.assertEqual(len(gcode), total['bytes'])
+            self.assertEqual(gcode.count('G0 '), total['g0_moves'])
+            self.assertEqual(gcode.count('G1 F1 X'), total['g1_moves'])
+            self.assertEqual(2 * 8 * 9, total['pixels'])
+            self.assertTrue(total['seconds']['decode'] > 0)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import logging
+from unittest.mock import patch
+import os
+import sys
+import shutil
+import tempfile
+from PIL import Image
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from peachyraster.decode import Volume, load_mask
+from peachyraster.raster import Raster
+
+
+class VolumeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.images = os.path.join(self.folder, 'images')
+        os.makedirs(self.images)
+        random = np.random.RandomState(11)
+        self.slices = (random.rand(4, 9, 12) * 255).astype(np.uint8)
+        self.slices[random.rand(4, 9, 12) > 0.6] = 0
+        for index, pixels in enumerate(self.slices):
+            Image.fromarray(pixels).save(os.path.join(self.images, '{:03d}.png'.format(index)))
+        self.npy_file_name = os.path.join(self.folder, 'volume.npy')
+        np.save(self.npy_file_name, self.slices)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def save_tiff(self, description=None, compression=None):
+        file_name = os.path.join(self.folder, 'volume.tif')
+        pages = [Image.fromarray(pixels) for pixels in self.slices]
+        settings = {'description': description} if description else {}
+        if compression:
+            settings['compression'] = compression
+        pages[0].save(file_name, save_all=True, append_images=pages[1:], **settings)
+        return file_name
+
+    def rastered(self, action, source, layer_height=0.1, **settings):
+        output_file_name = os.path.join(self.folder, 'out.gcode')
+        getattr(Raster(0.1, 1, output_file_name, layer_height, back_and_forth=True, **settings), action)(source)
+        with open(output_file_name) as output_file:
+            return output_file.read()
+
+    def test_volume_slices_should_match_loaded_images(self):
+        for file_name in [self.npy_file_name, self.save_tiff(), self.save_tiff(compression='tiff_lzw')]:
+            volume = Volume(file_name, 100)
+            self.assertEqual((4, 9, 12), volume.shape)
+            for index in range(len(volume)):
+                expected = load_mask(os.path.join(self.images, '{:03d}.png'.format(index)), 100)
+                self.assertTrue(np.array_equal(expected, volume[index][0:9]), file_name)
+
+    def test_volume_should_open_compressed_tiffs_once_for_many_pages(self):
+        pages = (np.random.RandomState(12).rand(300, 16, 16) * 255).astype(np.uint8)
+        file_name = os.path.join(self.folder, 'pages.tif')
+        images = [Image.fromarray(pixels) for pixels in pages]
+        images[0].save(file_name, save_all=True, append_images=images[1:], compression='tiff_adobe_deflate')
+        with patch.object(Image, 'open', wraps=Image.open) as opened:
+            volume = Volume(file_name, 100)
+            for index in list(range(len(volume))) + [299, 0, 150]:
+                self.assertTrue(np.array_equal(pages[index] <= 100, volume[index][0:16]), index)
+            volume.close()
+        self.assertEqual(2, opened.call_count)
+
+    def test_volume_should_map_uncompressed_tiff_pages(self):
+        volume = Volume(self.save_tiff())
+        self.assertTrue(all(table is not None for table in volume.pages))
+
+    def test_volume_should_read_imagej_slice_spacing(self):
+        self.assertEqual(0.05, Volume(self.save_tiff('ImageJ=1.53\nimages=4\nslices=4\nunit=micron\nspacing=50\n')).spacing)
+        self.assertEqual(None, Volume(self.save_tiff()).spacing)
+        self.assertEqual(None, Volume(self.npy_file_name).spacing)
+
+    def test_process_volume_should_match_process_folder(self):
+        expected = self.rastered('process_folder', self.images)
+        self.assertEqual(expected, self.rastered('process_volume', self.npy_file_name))
+        self.assertEqual(expected, self.rastered('process_volume', self.npy_file_name, jobs=2))
+        self.assertEqual(expected, self.rastered('process_volume', self.npy_file_name, jobs=2, diff_layers=True))
+        self.assertEqual(expected, self.rastered('process_volume', self.save_tiff(compression='tiff_lzw'), jobs=2))
+        spaced = self.save_tiff('ImageJ=1.53\nimages=4\nslices=4\nunit=mm\nspacing=0.1\n')
+        self.assertEqual(expected, self.rastered('process_volume', spaced, layer_height=0.3))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()